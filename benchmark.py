@@ -0,0 +1,312 @@
+# Benchmarks sem navegador:
+#   python benchmark.py gerar --banco /tmp/cotolengo.db --funcionarios 10000 --folgas 20
+#       popula um banco com elenco sintético (turnos, locais e folgas configuráveis);
+#       um arquivo existente só é substituído com --sobrescrever
+#   python benchmark.py caminhos --funcionarios 100 1000 10000 100000 --saida resultados.json
+#       mede load_all, buscar_por_dia, buscar_por_nome, save e render_calendar_html: p50/p95,
+#       consultas SQL por operação e pico de memória; o JSON permite comparar commits
+#   python benchmark.py escala --funcionarios 2000 --folgas 20
+#       motor da escala (calcular_escala) contra as regras originais, que chamavam buscar_por_dia dia a dia
+#   python benchmark.py memoria --funcionarios 100000 --folgas 10
+#       bytes por funcionário carregado: representação original x atual (__slots__, strings internadas, array de ordinais)
+import argparse
+import calendar
+import gc
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import streamlit.config
+import streamlit.logger
+
+# Fora do `streamlit run` não há ScriptRunContext e o Streamlit avisaria disso a cada st.cache_*
+# (e já na importação do app); aqui esses avisos são só ruído na saída. A opção logger.level
+# também muda porque a leitura da configuração, feita depois, reaplicaria o nível dela
+streamlit.config.set_option("logger.level", "error")
+streamlit.logger.set_log_level("error")
+
+import streamlit_app as app
+
+PRENOMES = ["João", "Maria", "José", "Ana", "Antônio", "Francisca", "Conceição", "Luís", "Márcia", "Sebastião",
+            "Lúcia", "Cláudio", "Patrícia", "Fábio", "Mônica", "André", "Célia", "Vinícius", "Inês", "Raí"]
+SOBRENOMES = ["Silva", "Santos", "Oliveira", "Souza", "Conceição", "Araújo", "Gonçalves", "Fernandes", "Lima", "Ribeiro",
+              "Assunção", "Simões", "Magalhães", "Brandão", "Guimarães", "Nóbrega", "Pereira", "Damásio"]
+
+def elenco_sintetico(quantidade, folgas_por_pessoa, seed=42, turnos=None, locais=None):
+    rng = random.Random(seed)
+    hoje = date.today()
+    turnos = turnos or app.TURNOS + [None]
+    locais = locais or ["UH", "UCCI", None]
+    funcionarios = []
+    for i in range(quantidade):
+        nome = f"{rng.choice(PRENOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}"
+        f = app.Funcionario(str(i), nome, f"C{i}", "técnico", "FT - EFETIVADO", hoje - timedelta(days=rng.randint(0, 3000)),
+                            turno=rng.choice(turnos), local=rng.choice(locais))
+        for _ in range(folgas_por_pessoa):
+            inicio = hoje + timedelta(days=rng.randint(-1500, 120))
+            f.folgas.append((inicio, inicio + timedelta(days=rng.randint(0, 20))))
+        funcionarios.append(f)
+    return funcionarios
+
+# Reprodução fiel da regra anterior: buscar_por_dia + três filtros por célula
+def escala_regras_antigas(funcionarios, ano, mes):
+    last_day_parity = calendar.monthrange(ano, mes)[1] % 2 == 0
+    # Antes as folgas eram uma lista de tuplas de datas
+    folgas = {f.id: list(f.folgas) for f in funcionarios}
+    resultado = {}
+    for dia in range(1, calendar.monthrange(ano, mes)[1] + 1):
+        data_consulta = date(ano, mes, dia)
+        prestadores = []
+        for f in funcionarios:
+            if f.turno:
+                em_folga = any(data_inicio <= data_consulta <= data_fim for data_inicio, data_fim in folgas[f.id])
+                if not em_folga:
+                    if last_day_parity:
+                        if (f.turno == "Dia 2" and dia % 2 == 1) or (f.turno == "Dia 1" and dia % 2 == 0) or \
+                           (f.turno == "Noite 2" and dia % 2 == 1) or (f.turno == "Noite 1" and dia % 2 == 0):
+                            prestadores.append(f)
+                    else:
+                        if (f.turno == "Dia 1" and dia % 2 == 1) or (f.turno == "Dia 2" and dia % 2 == 0) or \
+                           (f.turno == "Noite 1" and dia % 2 == 1) or (f.turno == "Noite 2" and dia % 2 == 0):
+                            prestadores.append(f)
+                else:
+                    prestadores.append(f)
+        em_folga = lambda p: any(di <= data_consulta <= df for di, df in folgas[p.id])
+        resultado[dia] = (
+            [p.id for p in sorted([p for p in prestadores if "Dia" in p.turno and not em_folga(p)], key=lambda x: x.nome)],
+            [p.id for p in sorted([p for p in prestadores if "Noite" in p.turno and not em_folga(p)], key=lambda x: x.nome)],
+            [p.id for p in sorted([p for p in prestadores if em_folga(p)], key=lambda x: x.nome)],
+        )
+    return resultado
+
+def escala_motor(funcionarios, ano, mes):
+    escala = app.calcular_escala(date(ano, mes, 1), date(ano, mes, calendar.monthrange(ano, mes)[1]), funcionarios)
+    return {d.day: tuple([p.id for p in grupo] for grupo in escala.do_dia(d)) for d in escala.dias}
+
+def cronometrar(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, min(tempos)
+
+def comparar_escala(args):
+    funcionarios = elenco_sintetico(args.funcionarios, args.folgas)
+    hoje = date.today()
+    # Meses de 28, 29, 30 e 31 dias cobrem as duas paridades de último dia
+    for ano, mes in [(hoje.year, hoje.month), (2024, 2), (2023, 2), (2024, 4), (2024, 7)]:
+        antigo, t_antigo = cronometrar(lambda: escala_regras_antigas(funcionarios, ano, mes), args.repeticoes)
+        novo, t_novo = cronometrar(lambda: escala_motor(funcionarios, ano, mes), args.repeticoes)
+        if antigo != novo:
+            raise SystemExit(f"Divergência na escala de {mes:02d}/{ano}")
+        print(f"{mes:02d}/{ano}: regras antigas {t_antigo * 1000:.1f} ms, motor {t_novo * 1000:.1f} ms ({t_antigo / t_novo:.1f}x), saída idêntica")
+
+# Representação anterior do Funcionario: objeto com __dict__ e folgas como lista de tuplas de datas
+class FuncionarioOriginal:
+    def __init__(self, id, nome, coren, cargo, tipo_vinculo, data_admissao, gerente=False, turno=None, local=None):
+        self.id = id
+        self.nome = nome
+        self.coren = coren
+        self.cargo = cargo
+        self.tipo_vinculo = tipo_vinculo
+        self.data_admissao = data_admissao
+        self.gerente = gerente
+        self.turno = turno
+        self.local = local
+        self._senha_hash = None
+        self.folgas = []
+
+def carregar_original(caminho):
+    conn = sqlite3.connect(caminho)
+    carregados = {}
+    for row in conn.execute('SELECT * FROM funcionarios'):
+        f = FuncionarioOriginal(row[0], row[1], row[2], row[3], row[4], date.fromisoformat(row[5]), bool(row[6]), row[7], row[8])
+        f._senha_hash = row[9]
+        carregados[row[0]] = f
+    for id_funcionario, data_inicio, data_fim in conn.execute('SELECT id_funcionario, data_inicio, data_fim FROM folgas'):
+        carregados[id_funcionario].folgas.append((date.fromisoformat(data_inicio), date.fromisoformat(data_fim)))
+    conn.close()
+    return carregados
+
+def medir_memoria(carregar):
+    gc.collect()
+    tracemalloc.start()
+    carregados = carregar()
+    memoria, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return memoria, len(carregados)
+
+def relatorio_memoria(args):
+    with tempfile.TemporaryDirectory() as pasta:
+        usar_banco(os.path.join(pasta, "cotolengo.db"))
+        app.Funcionario.save_many(elenco_sintetico(args.funcionarios, args.folgas))
+        antes, n = medir_memoria(lambda: carregar_original(app.CAMINHO_DB))
+        depois, _ = medir_memoria(app.Funcionario.ler_todos)
+    print(f"{n} funcionários, {args.folgas} folgas por pessoa")
+    print(f"antes:  {antes / n:8.0f} bytes/funcionário ({antes / 2**20:.1f} MiB)")
+    print(f"depois: {depois / n:8.0f} bytes/funcionário ({depois / 2**20:.1f} MiB), {100 * (1 - depois / antes):.0f}% menos")
+
+# Aponta o app para outro arquivo e descarta pool, cache do elenco e calendários do banco anterior
+def usar_banco(caminho):
+    app.CAMINHO_DB = caminho
+    app.pool_de_conexoes.clear()
+    app.cache_do_elenco.clear()
+    app.cache_de_calendarios.clear()
+    app.init_db()
+
+def gerar_banco(caminho, funcionarios, folgas, seed=42, turnos=None, locais=None, sobrescrever=False):
+    if os.path.exists(caminho) and not sobrescrever:
+        raise FileExistsError(f"{caminho} já existe (use --sobrescrever para substituí-lo)")
+    # Junto com os arquivos do WAL: um -wal antigo seria reaplicado sobre o banco novo
+    for arquivo in (caminho, caminho + "-wal", caminho + "-shm", caminho + "-journal"):
+        if os.path.exists(arquivo):
+            os.remove(arquivo)
+    usar_banco(caminho)
+    # Lotes de 10 mil para não montar o elenco inteiro antes de gravar
+    for inicio in range(0, funcionarios, 10000):
+        lote = elenco_sintetico(min(10000, funcionarios - inicio), folgas, seed + inicio, turnos, locais)
+        for i, f in enumerate(lote):
+            f.id = f.coren = str(inicio + i)
+        app.Funcionario.save_many(lote)
+
+def gerar(args):
+    try:
+        gerar_banco(args.banco, args.funcionarios, args.folgas, args.seed, args.turnos, args.locais, args.sobrescrever)
+    except FileExistsError as e:
+        sys.exit(str(e))
+    print(f"{args.banco}: {args.funcionarios} funcionários, {args.folgas} folgas por pessoa")
+
+def medir(nome, operacao, repeticoes):
+    # Latências com o rastreador SQL contando comandos; o pico de memória sai de uma execução
+    # separada sob tracemalloc, que deixaria as latências mais lentas
+    rastreador = app.rastreador_sql()
+    operacao(repeticoes)  # aquecimento: índices e caches de parsing já construídos
+    tempos = []
+    consultas_antes = rastreador.total
+    for i in range(repeticoes):
+        inicio = time.perf_counter()
+        operacao(i)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    consultas = (rastreador.total - consultas_antes) / repeticoes
+    gc.collect()
+    tracemalloc.start()
+    operacao(repeticoes + 1)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    tempos.sort()
+    return {
+        "caminho": nome,
+        "repeticoes": repeticoes,
+        "p50_ms": round(statistics.median(tempos), 3),
+        "p95_ms": round(tempos[min(len(tempos) - 1, int(0.95 * len(tempos)))], 3),
+        "media_ms": round(statistics.fmean(tempos), 3),
+        "consultas_por_operacao": round(consultas, 2),
+        "pico_memoria_kib": round(pico / 1024, 1),
+    }
+
+def medir_caminhos(quantidade, args, pasta):
+    caminho = os.path.join(pasta, f"cotolengo_{quantidade}.db")
+    gerar_banco(caminho, quantidade, args.folgas, args.seed, args.turnos, args.locais)
+    usar_banco(caminho)
+    rng = random.Random(args.seed)
+    hoje = date.today()
+    ano, mes = hoje.year, hoje.month
+    ultimo_dia = calendar.monthrange(ano, mes)[1]
+    ids = [str(i) for i in range(quantidade)]
+    consultas_nome = [rng.choice(PRENOMES)[:tamanho] for tamanho in (1, 2, 3, 5)] + ["conceicao", "silva santos", "inexistente"]
+    r = args.repeticoes
+
+    def visualizacao(i):
+        # As duas quinzenas de visualizacao_geral, sem cache de HTML
+        escala = app.escala_do_mes(ano, mes)
+        app.render_calendar_html(ano, mes, 1, 15, escala)
+        app.render_calendar_html(ano, mes, 16, ultimo_dia, escala)
+
+    def salvar(i):
+        f = app.Funcionario.get_funcionario_por_id(rng.choice(ids)).copia()
+        f.turno = app.TURNOS[i % len(app.TURNOS)]
+        inicio = hoje + timedelta(days=rng.randint(0, 60))
+        f.folgas.append((inicio, inicio + timedelta(days=2)))
+        f.save()
+
+    resultados = [medir("load_all", lambda i: app.Funcionario.load_all(), max(3, r // 10))]
+    resultados.append(medir("buscar_por_dia", lambda i: app.Funcionario.buscar_por_dia(i % ultimo_dia + 1, mes, ano,
+                                                                                       ultimo_dia % 2 == 0), r))
+    resultados.append(medir("buscar_por_nome", lambda i: app.Funcionario.buscar_por_nome(consultas_nome[i % len(consultas_nome)]), r))
+    resultados.append(medir("save", salvar, r))
+    resultados.append(medir("render_calendar_html", visualizacao, max(3, r // 10)))
+    resultados.append(medir("calendario_html (cache)", lambda i: app.calendario_html(ano, mes, 1, 15), r))
+    for resultado in resultados:
+        resultado["funcionarios"] = quantidade
+    return resultados
+
+def commit_atual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def caminhos(args):
+    resultados = []
+    with tempfile.TemporaryDirectory() as pasta:
+        for quantidade in args.funcionarios:
+            for resultado in medir_caminhos(quantidade, args, pasta):
+                resultados.append(resultado)
+                print(f"{quantidade:>7} {resultado['caminho']:<24} p50 {resultado['p50_ms']:>9.2f} ms  p95 {resultado['p95_ms']:>9.2f} ms  "
+                      f"{resultado['consultas_por_operacao']:>6.1f} consultas/op  pico {resultado['pico_memoria_kib']:>10.1f} KiB")
+    if args.saida:
+        relatorio = {
+            "commit": commit_atual(),
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "parametros": {"folgas": args.folgas, "repeticoes": args.repeticoes, "seed": args.seed,
+                           "turnos": args.turnos, "locais": args.locais},
+            "resultados": resultados,
+        }
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do elenco e da escala.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    gerador = subparsers.add_parser("gerar", help="popula um banco com elenco sintético")
+    # Sem padrão: apontar para o banco do app por engano apagaria os dados reais
+    gerador.add_argument("--banco", required=True, help="arquivo SQLite a criar")
+    gerador.add_argument("--sobrescrever", action="store_true", help="substitui o arquivo se ele já existir")
+    gerador.add_argument("--funcionarios", type=int, default=1000)
+    gerador.set_defaults(executar=gerar)
+    medidor = subparsers.add_parser("caminhos", help="mede os caminhos quentes do elenco em bancos sintéticos")
+    medidor.add_argument("--repeticoes", type=int, default=50)
+    medidor.add_argument("--funcionarios", type=int, nargs="+", default=[100, 1000, 10000])
+    medidor.add_argument("--saida", help="arquivo JSON com os resultados")
+    medidor.set_defaults(executar=caminhos)
+    for sub in (gerador, medidor):
+        sub.add_argument("--folgas", type=int, default=10, help="folgas por pessoa")
+        sub.add_argument("--seed", type=int, default=42)
+        sub.add_argument("--turnos", nargs="+", help=f"turnos sorteados (padrão: {', '.join(app.TURNOS)} e sem turno)")
+        sub.add_argument("--locais", nargs="+", help="locais sorteados (padrão: UH, UCCI e sem local)")
+    escala = subparsers.add_parser("escala", help="compara o motor da escala com as regras originais")
+    escala.add_argument("--repeticoes", type=int, default=3)
+    escala.set_defaults(executar=comparar_escala)
+    memoria = subparsers.add_parser("memoria", help="bytes por funcionário antes e depois da representação compacta")
+    memoria.set_defaults(executar=relatorio_memoria)
+    for sub in (escala, memoria):
+        sub.add_argument("--funcionarios", type=int, default=1000)
+        sub.add_argument("--folgas", type=int, default=10, help="folgas por pessoa")
+    args = parser.parse_args()
+    args.executar(args)
+
+if __name__ == "__main__":
+    main()
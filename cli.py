@@ -0,0 +1,100 @@
+# Operações em lote sem navegador, no mesmo banco do app (COTOLENGO_DB ou --banco):
+#   python cli.py importar --prestadores prestadores.csv --folgas folgas.csv
+#       valida em lotes e grava tudo em uma única transação; as linhas com erro são listadas e ficam de fora
+#   python cli.py exportar --prestadores prestadores.csv --folgas folgas.csv
+#       grava os CSVs direto do cursor, no formato aceito pela importação ("-" escreve na saída padrão)
+#   python cli.py escalas --de 2025-01 --ate 2025-12 --pasta escalas
+#       escala de cada mês e local em HTML imprimível e CSV, meses calculados em paralelo
+import argparse
+import sys
+import time
+from datetime import datetime
+
+import streamlit.config
+import streamlit.logger
+
+# Fora do `streamlit run` não há ScriptRunContext e o Streamlit avisaria disso a cada st.cache_*
+# (e já na importação do app); aqui esses avisos são só ruído na saída. A opção logger.level
+# também muda porque a leitura da configuração, feita depois, reaplicaria o nível dela
+streamlit.config.set_option("logger.level", "error")
+streamlit.logger.set_log_level("error")
+
+import streamlit_app as app
+
+def importar(args):
+    if not args.prestadores and not args.folgas:
+        sys.exit("informe --prestadores e/ou --folgas")
+    arquivos = [open(caminho, encoding="utf-8-sig", newline="") if caminho else None for caminho in (args.prestadores, args.folgas)]
+    try:
+        resultado = app.importar_csv(*arquivos)
+    except ValueError as e:
+        sys.exit(f"importação cancelada: {e}")
+    finally:
+        for arquivo in arquivos:
+            if arquivo is not None:
+                arquivo.close()
+    for arquivo, linha, mensagem in resultado.erros:
+        print(f"{arquivo}:{linha}: {mensagem}", file=sys.stderr)
+    print(f"{resultado.prestadores} prestador(es) e {resultado.folgas} folga(s) importados, "
+          f"{resultado.folgas_repetidas} folga(s) repetida(s) ignorada(s), {len(resultado.erros)} linha(s) com erro")
+    return 1 if resultado.erros else 0
+
+def exportar(args):
+    if not args.prestadores and not args.folgas:
+        sys.exit("informe --prestadores e/ou --folgas")
+    for caminho, gerar in ((args.prestadores, app.exportar_prestadores_csv), (args.folgas, app.exportar_folgas_csv)):
+        if not caminho:
+            continue
+        if caminho == "-":
+            sys.stdout.writelines(gerar())
+        else:
+            with open(caminho, "w", encoding="utf-8", newline="") as arquivo:
+                arquivo.writelines(gerar())
+    return 0
+
+def mes_do_ano(texto):
+    try:
+        data = datetime.strptime(texto, "%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"mês inválido: {texto!r} (use AAAA-MM)")
+    return data.year, data.month
+
+def escalas(args):
+    meses = app.meses_do_periodo(args.de, args.ate or args.de)
+    if not meses:
+        sys.exit("--ate anterior a --de")
+    inicio = time.perf_counter()
+    gravados = 0
+    for caminho in app.exportar_escalas(meses, args.pasta, args.locais, args.formatos, args.processos):
+        print(caminho)
+        gravados += 1
+    print(f"{gravados} arquivo(s) de {len(meses)} mês(es) em {time.perf_counter() - inicio:.1f} s", file=sys.stderr)
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Importação, exportação e relatórios do Sistema Cotolengo.")
+    parser.add_argument("--banco", help="arquivo SQLite (padrão: COTOLENGO_DB ou cotolengo.db)")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    importador = subparsers.add_parser("importar", help="importa prestadores e folgas de arquivos CSV")
+    importador.set_defaults(executar=importar)
+    exportador = subparsers.add_parser("exportar", help="exporta prestadores e folgas para arquivos CSV")
+    exportador.set_defaults(executar=exportar)
+    for sub in (importador, exportador):
+        sub.add_argument("--prestadores", help="CSV de prestadores")
+        sub.add_argument("--folgas", help="CSV de folgas")
+    gerador = subparsers.add_parser("escalas", help="gera a escala de vários meses em HTML e CSV, por local")
+    gerador.add_argument("--de", type=mes_do_ano, required=True, help="primeiro mês (AAAA-MM)")
+    gerador.add_argument("--ate", type=mes_do_ano, help="último mês (AAAA-MM; padrão: o mesmo de --de)")
+    gerador.add_argument("--pasta", default="escalas", help="pasta de saída")
+    gerador.add_argument("--locais", nargs="+", choices=app.LOCAIS, default=app.LOCAIS)
+    gerador.add_argument("--formatos", nargs="+", choices=["html", "csv"], default=["html", "csv"])
+    gerador.add_argument("--processos", type=int, help="processos em paralelo (padrão: um por CPU)")
+    gerador.set_defaults(executar=escalas)
+    args = parser.parse_args()
+    if args.banco:
+        app.CAMINHO_DB = args.banco
+    app.init_db()
+    sys.exit(args.executar(args))
+
+if __name__ == "__main__":
+    main()
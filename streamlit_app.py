@@ -2,30 +2,687 @@ import streamlit as st
 from datetime import date, datetime, timedelta
 import calendar
 import hashlib
+import os
+import re
+import json
+import sys
 import time
+import threading
+import unicodedata
+import queue
+import csv
+import io
+import tempfile
+import pathlib
+from array import array
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
 from streamlit_js_eval import streamlit_js_eval
 import sqlite3
+import numpy as np
 
-# Conexão com o banco de dados SQLite
+CAMINHO_DB = os.environ.get('COTOLENGO_DB', 'cotolengo.db')
+
+# =============================================================================
+# INSTRUMENTAÇÃO DE DESEMPENHO
+# =============================================================================
+# Forma da consulta: literais e listas de parâmetros viram "?", para agrupar execuções iguais
+_LITERAIS_SQL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTA_PARAMETROS = re.compile(r"\?(?:\s*,\s*\?)+")
+
+@lru_cache(maxsize=512)
+def forma_sql(sql):
+    return " ".join(_LISTA_PARAMETROS.sub("?", _LITERAIS_SQL.sub("?", sql)).split())
+
+# Medições de um rerun: tempo por fase e, por forma de consulta, execuções e tempo
+class MedicaoRerun:
+    def __init__(self, pagina):
+        self.inicio = datetime.now()
+        self.pagina = pagina
+        self.fases = {}
+        self.sql = {}
+        self.execucoes = 0
+        self.total_ms = 0.0
+    def registrar(self, sql, execucoes, segundos):
+        forma = forma_sql(sql)
+        consulta = self.sql.get(forma)
+        if consulta is None:
+            consulta = self.sql[forma] = {"execucoes": 0, "chamadas": 0, "ms": 0.0}
+        consulta["execucoes"] += execucoes
+        consulta["chamadas"] += 1
+        consulta["ms"] += segundos * 1000
+    def como_dict(self):
+        return {
+            "inicio": self.inicio.isoformat(timespec="seconds"),
+            "pagina": self.pagina,
+            "total_ms": round(self.total_ms, 2),
+            "fases": {nome: round(ms, 2) for nome, ms in self.fases.items()},
+            "sql_execucoes": self.execucoes,
+            "sql": {forma: dict(c, ms=round(c["ms"], 2)) for forma, c in self.sql.items()},
+        }
+
+# Conta os comandos SQL executados em todas as conexões do processo (trace callback do sqlite3)
+# e na medição do rerun em andamento na thread atual. O callback roda a cada comando, inclusive
+# em cada linha de um executemany, então só incrementa contadores; a forma da consulta é
+# calculada uma vez por chamada, no CursorRastreado
+class RastreadorSQL:
+    def __init__(self):
+        self.total = 0
+        self._local = threading.local()
+    @property
+    def medicao(self):
+        return getattr(self._local, "medicao", None)
+    @medicao.setter
+    def medicao(self, medicao):
+        self._local.medicao = medicao
+    def registrar(self, sql):
+        self.total += 1
+        medicao = getattr(self._local, "medicao", None)
+        if medicao is not None:
+            medicao.execucoes += 1
+
+@st.cache_resource
+def rastreador_sql():
+    return RastreadorSQL()
+
+# Cursor/conexão que cronometram execute e executemany (até o primeiro resultado; a iteração
+# das linhas fica de fora para não pagar uma chamada Python por linha). As execuções da chamada
+# são a diferença no contador do trace callback, sem materializar os parâmetros do executemany
+class CursorRastreado(sqlite3.Cursor):
+    def _medir(self, executar, sql, parametros):
+        medicao = self.connection.rastreador.medicao
+        if medicao is None:
+            return executar(sql, parametros)
+        execucoes = medicao.execucoes
+        inicio = time.perf_counter()
+        try:
+            return executar(sql, parametros)
+        finally:
+            medicao.registrar(sql, medicao.execucoes - execucoes, time.perf_counter() - inicio)
+    def execute(self, sql, parametros=()):
+        return self._medir(super().execute, sql, parametros)
+    def executemany(self, sql, parametros):
+        return self._medir(super().executemany, sql, parametros)
+
+class ConexaoRastreada(sqlite3.Connection):
+    def cursor(self, factory=CursorRastreado):
+        return super().cursor(factory)
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+# Cronometra uma fase do rerun atual; serve como `with medir_fase("x"):` ou como decorador
+@contextmanager
+def medir_fase(nome):
+    medicao = rastreador_sql().medicao
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        if medicao is not None:
+            medicao.fases[nome] = medicao.fases.get(nome, 0.0) + (time.perf_counter() - inicio) * 1000
+
+RERUNS_NO_PAINEL = 20
+ARQUIVO_LOG_DESEMPENHO = os.environ.get('COTOLENGO_LOG_DESEMPENHO', 'desempenho.jsonl')
+
+# Mede o rerun inteiro; guarda os últimos na sessão e, se pedido, grava uma linha JSON no log
+@contextmanager
+def medir_rerun():
+    rastreador = rastreador_sql()
+    medicao = MedicaoRerun(st.session_state.get("pagina", "login"))
+    rastreador.medicao = medicao
+    inicio = time.perf_counter()
+    try:
+        yield medicao
+    finally:
+        medicao.total_ms = (time.perf_counter() - inicio) * 1000
+        rastreador.medicao = None
+        registro = medicao.como_dict()
+        if "desempenho" not in st.session_state:
+            st.session_state["desempenho"] = deque(maxlen=RERUNS_NO_PAINEL)
+        st.session_state["desempenho"].append(registro)
+        if st.session_state.get("log_desempenho") or os.environ.get('COTOLENGO_LOG_DESEMPENHO'):
+            with open(ARQUIVO_LOG_DESEMPENHO, "a", encoding="utf-8") as arquivo:
+                arquivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+# Conexão com o banco de dados SQLite, já ajustada: WAL deixa leitores e um escritor trabalharem
+# em paralelo e busy_timeout espera o lock em vez de falhar com "database is locked"
 def get_db_connection():
-    conn = sqlite3.connect('cotolengo.db', check_same_thread=False)
+    # isolation_level=None: as transações são abertas explicitamente por transacao()
+    conn = sqlite3.connect(CAMINHO_DB, check_same_thread=False, isolation_level=None, cached_statements=256, factory=ConexaoRastreada)
+    conn.rastreador = rastreador_sql()
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA busy_timeout=5000')
+    conn.set_trace_callback(conn.rastreador.registrar)
     return conn
 
+# Pool de conexões reaproveitadas entre reruns e sessões; cada conexão mantém seu cache
+# de statements preparados, então o mesmo SQL não é recompilado a cada operação
+class PoolConexoes:
+    def __init__(self, tamanho=8):
+        self._livres = queue.LifoQueue(maxsize=tamanho)
+    @contextmanager
+    def conexao(self):
+        try:
+            conn = self._livres.get_nowait()
+        except queue.Empty:
+            conn = get_db_connection()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._livres.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+    @contextmanager
+    def transacao(self):
+        # BEGIN IMMEDIATE pega o lock de escrita logo no início, evitando deadlock de upgrade de lock
+        with self.conexao() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+@st.cache_resource
+def pool_de_conexoes():
+    return PoolConexoes()
+
+def conexao():
+    return pool_de_conexoes().conexao()
+
+def transacao():
+    return pool_de_conexoes().transacao()
+
+# Versão do schema gravada em PRAGMA user_version; aumente ao mudar init_db
+VERSAO_SCHEMA = 3
+
 # Criar tabelas se não existirem
 def init_db():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS funcionarios 
-                 (id TEXT PRIMARY KEY, nome TEXT, coren TEXT, cargo TEXT, tipo_vinculo TEXT, data_admissao TEXT, gerente INTEGER, turno TEXT, local TEXT, senha_hash TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS folgas 
-                 (id_funcionario TEXT, data_inicio TEXT, data_fim TEXT, FOREIGN KEY(id_funcionario) REFERENCES funcionarios(id))''')
-    conn.commit()
-    conn.close()
+    # Chamado a cada rerun: quando o schema já está atualizado não abre transação de escrita
+    with conexao() as conn:
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= VERSAO_SCHEMA:
+            return
+    with transacao() as c:
+        c.execute('''CREATE TABLE IF NOT EXISTS funcionarios 
+                     (id TEXT PRIMARY KEY, nome TEXT, coren TEXT, cargo TEXT, tipo_vinculo TEXT, data_admissao TEXT, gerente INTEGER, turno TEXT, local TEXT, senha_hash TEXT)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS folgas 
+                     (id_funcionario TEXT, data_inicio TEXT, data_fim TEXT, FOREIGN KEY(id_funcionario) REFERENCES funcionarios(id))''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_folgas_funcionario ON folgas(id_funcionario)')
+        # Registro de alterações: cada escrita grava uma linha com versão crescente para os outros processos
+        c.execute('''CREATE TABLE IF NOT EXISTS alteracoes
+                     (versao INTEGER PRIMARY KEY AUTOINCREMENT, id_funcionario TEXT, operacao TEXT, criado_em TEXT)''')
+        # Bancos da versão 2: linhas antigas ficam sem data e saem na primeira poda
+        if "criado_em" not in [row[1] for row in c.execute('PRAGMA table_info(alteracoes)')]:
+            c.execute('ALTER TABLE alteracoes ADD COLUMN criado_em TEXT')
+        # Marcador da última execução de cada tarefa de manutenção, compartilhado entre processos
+        c.execute('CREATE TABLE IF NOT EXISTS manutencao (tarefa TEXT PRIMARY KEY, ultima_execucao TEXT)')
+        c.execute(f'PRAGMA user_version = {VERSAO_SCHEMA}')
+
+# Datas ISO se repetem muito entre folgas e admissões: converte cada texto uma única vez
+@lru_cache(maxsize=4096)
+def parse_data(texto):
+    return date.fromisoformat(texto)
+
+@lru_cache(maxsize=4096)
+def ordinal_iso(texto):
+    return date.fromisoformat(texto).toordinal()
+
+def registrar_alteracao(c, id_funcionario, operacao):
+    c.execute("INSERT INTO alteracoes (id_funcionario, operacao, criado_em) VALUES (?, ?, datetime('now'))", (id_funcionario, operacao))
+    return c.lastrowid
+
+# Várias linhas de uma vez; sob o lock de escrita as versões saem consecutivas
+def registrar_alteracoes(c, ids, operacao):
+    c.executemany("INSERT INTO alteracoes (id_funcionario, operacao, criado_em) VALUES (?, ?, datetime('now'))", [(id, operacao) for id in ids])
+    ultima = c.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return ultima - len(ids) + 1, ultima
+
+def versao_alteracoes(c):
+    return c.execute('SELECT COALESCE(MAX(versao), 0) FROM alteracoes').fetchone()[0]
+
+# Folgas de um funcionário. Guarda os períodos como foram registrados (para exibir e gravar)
+# e, sob demanda, a versão ordenada e mesclada em dias ordinais para consultas por bisect.
+# Tudo em array('i') de ordinais: 8 bytes por período em vez de uma tupla com duas datas.
+class IntervalosFolga:
+    __slots__ = ("_ordinais", "_gravados", "_inicios", "_fins")
+    def __init__(self, periodos=()):
+        self._ordinais = array('i')
+        for inicio, fim in periodos:
+            self._ordinais.append(inicio.toordinal())
+            self._ordinais.append(fim.toordinal())
+        self._gravados = 0  # quantos períodos do início da lista já estão no banco
+        self._inicios = None
+        self._fins = None
+    def append(self, periodo):
+        self.adicionar_ordinais(periodo[0].toordinal(), periodo[1].toordinal())
+    def adicionar_ordinais(self, inicio, fim):
+        self._ordinais.append(inicio)
+        self._ordinais.append(fim)
+        self._inicios = self._fins = None
+    def _periodos(self, primeiro=0):
+        o = self._ordinais
+        return [(date.fromordinal(o[i]), date.fromordinal(o[i + 1])) for i in range(2 * primeiro, len(o), 2)]
+    def pendentes(self):
+        # Períodos registrados desde a última gravação
+        return self._periodos(self._gravados)
+    def marcar_gravados(self):
+        self._gravados = len(self._ordinais) // 2
+    def copia(self):
+        nova = IntervalosFolga()
+        nova._ordinais = array('i', self._ordinais)
+        nova._gravados = self._gravados
+        return nova
+    def __iter__(self):
+        return iter(self._periodos())
+    def __len__(self):
+        return len(self._ordinais) // 2
+    def __repr__(self):
+        return f"IntervalosFolga({self._periodos()!r})"
+    def _indexar(self):
+        # _fins é gravado antes de _inicios: quem encontra _inicios pronto (em outra thread) já tem _fins
+        if not self._ordinais:
+            self._fins = ()
+            self._inicios = ()
+            return
+        inicios, fins = array('i'), array('i')
+        o = self._ordinais
+        for inicio, fim in sorted((o[i], o[i + 1]) for i in range(0, len(o), 2) if o[i] <= o[i + 1]):
+            # Períodos que se sobrepõem ou encostam (fim + 1 dia) viram um só
+            if fins and inicio <= fins[-1] + 1:
+                fins[-1] = max(fins[-1], fim)
+            else:
+                inicios.append(inicio)
+                fins.append(fim)
+        self._fins = fins
+        self._inicios = inicios
+    def _indice(self):
+        inicios = self._inicios
+        if inicios is None:
+            self._indexar()
+            inicios = self._inicios
+        return inicios, self._fins
+    def intervalos(self):
+        # Intervalos mesclados como pares (início, fim) em dias ordinais
+        inicios, fins = self._indice()
+        return list(zip(inicios, fins))
+    def em_folga(self, data):
+        inicios, fins = self._indice()
+        dia = data.toordinal()
+        i = bisect_right(inicios, dia) - 1
+        return i >= 0 and fins[i] >= dia
+    def sobrepostos(self, inicio, fim):
+        # Intervalos mesclados que tocam [inicio, fim]; os fins também ficam ordenados após a mescla
+        inicios, fins = self._indice()
+        a, b = inicio.toordinal(), fim.toordinal()
+        primeiro = bisect_left(fins, a)
+        ultimo = bisect_right(inicios, b)
+        return [(date.fromordinal(i), date.fromordinal(f))
+                for i, f in zip(inicios[primeiro:ultimo], fins[primeiro:ultimo])]
+
+# Índice de folgas de todo o elenco, agrupado por mês: responde "quem está de folga no dia d"
+# olhando só os intervalos que tocam aquele mês. Montado uma vez a partir do elenco completo;
+# depois cada escrita só troca as listas dos meses tocados pelos funcionários alterados.
+class IndiceFolgas:
+    def __init__(self, funcionarios):
+        self._por_mes = {}
+        self._intervalos = {}
+        for f in funcionarios:
+            intervalos = f.folgas.intervalos()
+            if intervalos:
+                self._intervalos[f.id] = intervalos
+                for mes, inicio, fim in IndiceFolgas._meses(intervalos):
+                    self._por_mes.setdefault(mes, []).append((inicio, fim, f.id))
+    @staticmethod
+    def _meses(intervalos):
+        for inicio, fim in intervalos:
+            a, b = date.fromordinal(inicio), date.fromordinal(fim)
+            for mes in range(a.year * 12 + a.month - 1, b.year * 12 + b.month):
+                yield mes, inicio, fim
+    def atualizar(self, funcionarios=(), removidos=()):
+        # Chamado pelo cache do elenco, sob o lock dele; uma mudança de turno não mexe em nada
+        alterados = {}
+        for f in funcionarios:
+            intervalos = f.folgas.intervalos()
+            if intervalos != self._intervalos.get(f.id, []):
+                alterados[f.id] = intervalos
+        for id in removidos:
+            if id in self._intervalos:
+                alterados[id] = []
+        if not alterados:
+            return
+        novas = {}
+        meses = set()
+        for id, intervalos in alterados.items():
+            meses.update(mes for mes, _, _ in IndiceFolgas._meses(self._intervalos.get(id, ())))
+            for mes, inicio, fim in IndiceFolgas._meses(intervalos):
+                novas.setdefault(mes, []).append((inicio, fim, id))
+            if intervalos:
+                self._intervalos[id] = intervalos
+            else:
+                self._intervalos.pop(id, None)
+        # Listas novas no lugar das antigas: quem estiver lendo um mês nunca o vê pela metade
+        for mes in meses | novas.keys():
+            lista = [entrada for entrada in self._por_mes.get(mes, ()) if entrada[2] not in alterados] + novas.get(mes, [])
+            if lista:
+                self._por_mes[mes] = lista
+            else:
+                self._por_mes.pop(mes, None)
+    def ids_em_folga(self, data):
+        dia = data.toordinal()
+        return {id for inicio, fim, id in self._por_mes.get(data.year * 12 + data.month - 1, ()) if inicio <= dia <= fim}
+
+# Remove acentos e normaliza espaços/caixa: "Conceição" e "conceicao" passam a casar
+def normalizar_nome(texto):
+    decomposto = unicodedata.normalize("NFKD", texto)
+    return " ".join("".join(c for c in decomposto if not unicodedata.combining(c)).lower().split())
+
+# Índice de nomes por bigramas e trigramas, construído uma vez por carga completa do elenco;
+# depois as escritas só mexem nas listas de quem entrou, saiu ou mudou de nome.
+# Consultas de 3+ letras intersectam as listas de trigramas e só conferem os candidatos.
+class IndiceNomes:
+    def __init__(self, funcionarios):
+        self._nomes = {}
+        self._bigramas = {}
+        self._trigramas = {}
+        for f in funcionarios:
+            nome = normalizar_nome(f.nome)
+            self._nomes[f.id] = (nome, f.nome)
+            for tamanho, grams in ((2, self._bigramas), (3, self._trigramas)):
+                for i in range(len(nome) - tamanho + 1):
+                    grams.setdefault(nome[i:i + tamanho], set()).add(f.id)
+    @staticmethod
+    def _grams(nome, tamanho):
+        return {nome[i:i + tamanho] for i in range(len(nome) - tamanho + 1)}
+    def atualizar(self, funcionarios=(), removidos=()):
+        # Chamado pelo cache do elenco, sob o lock dele. Cada lista alterada é trocada por uma
+        # cópia, então uma busca em andamento nunca vê um conjunto mudando
+        for f in funcionarios:
+            anterior = self._nomes.get(f.id)
+            if anterior is not None and anterior[1] == f.nome:
+                continue
+            nome = normalizar_nome(f.nome)
+            self._trocar(f.id, anterior[0] if anterior is not None else "", nome)
+            self._nomes[f.id] = (nome, f.nome)
+        for id in removidos:
+            anterior = self._nomes.pop(id, None)
+            if anterior is not None:
+                self._trocar(id, anterior[0], "")
+    def _trocar(self, id, antigo, novo):
+        for tamanho, grams in ((2, self._bigramas), (3, self._trigramas)):
+            antigos, novos = IndiceNomes._grams(antigo, tamanho), IndiceNomes._grams(novo, tamanho)
+            for gram in antigos - novos:
+                restantes = grams[gram] - {id}
+                if restantes:
+                    grams[gram] = restantes
+                else:
+                    del grams[gram]
+            for gram in novos - antigos:
+                grams[gram] = grams.get(gram, set()) | {id}
+    def _candidatos(self, consulta):
+        if len(consulta) == 2:
+            return self._bigramas.get(consulta, ())
+        if len(consulta) >= 3:
+            listas = sorted((self._trigramas.get(consulta[i:i + 3], set()) for i in range(len(consulta) - 2)), key=len)
+            return set.intersection(*listas)
+        return list(self._nomes)
+    def buscar(self, consulta):
+        # Ids ordenados por relevância: nome igual, começo do nome, começo de uma palavra, trecho no meio
+        consulta = normalizar_nome(consulta)
+        ranqueados = []
+        for id in self._candidatos(consulta):
+            nome, original = self._nomes[id]
+            posicao = nome.find(consulta)
+            if posicao == -1:
+                continue
+            if nome == consulta:
+                nivel = 0
+            elif posicao == 0:
+                nivel = 1
+            elif nome[posicao - 1] == " ":
+                nivel = 2
+            else:
+                nivel = 3
+            ranqueados.append((nivel, posicao, original, id))
+        ranqueados.sort()
+        return [id for _, _, _, id in ranqueados]
+
+# Cache do elenco compartilhado por todas as sessões do processo.
+# Leituras usam o dicionário atual sem lock; escritas trocam por uma cópia (copy-on-write),
+# então quem estiver iterando o snapshot antigo nunca o vê mudar. Os objetos Funcionario do
+# cache também não são editados: as telas alteram uma cópia (Funcionario.copia) e o save,
+# depois do commit, põe a cópia no lugar do original.
+# Até alguma tela precisar do elenco inteiro (obter), funciona como identity map parcial:
+# obter_por_id carrega um funcionário por vez com uma consulta pela chave primária.
+class CacheFuncionarios:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.funcionarios = {}
+        self.carregado = False
+        self.versao = 0
+        self.versao_banco = 0
+        self.acertos = 0
+        self.falhas = 0
+        self._conn_monitor = None
+        self._data_version = None
+        self._indice_folgas = None
+        self._indice_nomes = None
+        self._cobertura = None
+        self.ultima_manutencao = None
+        self.ultima_poda = None
+    def obter(self):
+        if self.carregado:
+            self.acertos += 1
+            return self.funcionarios
+        with self._lock:
+            if not self.carregado:
+                self.falhas += 1
+                with conexao() as conn:
+                    self.versao_banco = versao_alteracoes(conn.cursor())
+                self.funcionarios = Funcionario.ler_todos()
+                self.carregado = True
+                self._descartar_derivados()
+                self.versao += 1
+            else:
+                self.acertos += 1
+            return self.funcionarios
+    def obter_por_id(self, id):
+        funcionario = self.funcionarios.get(id)
+        if funcionario is not None or self.carregado:
+            # Com o elenco completo em memória, ausência no dicionário já é a resposta
+            self.acertos += 1
+            return funcionario
+        with self._lock:
+            if id in self.funcionarios or self.carregado:
+                self.acertos += 1
+                return self.funcionarios.get(id)
+            self.falhas += 1
+            if not self.funcionarios:
+                # Primeiro objeto do identity map: a partir daqui sincronizar() acompanha as alterações
+                with conexao() as conn:
+                    self.versao_banco = versao_alteracoes(conn.cursor())
+            funcionario = Funcionario.ler_um(id)
+            if funcionario is not None:
+                novos = dict(self.funcionarios)
+                novos[id] = funcionario
+                self.funcionarios = novos
+            return funcionario
+    def recarregar(self):
+        with self._lock:
+            self.carregado = False
+        return self.obter()
+    def atualizar(self, funcionarios, versoes=None):
+        # versoes: (primeira, última) linha de alteracoes gravada junto com estes funcionários
+        with self._lock:
+            if not self.carregado and not self.funcionarios and versoes is not None:
+                # Identity map vazio: estes objetos são o estado mais recente a partir desta versão
+                self.versao_banco = versoes[1]
+            elif versoes is not None:
+                self._avancar_versao_banco(*versoes)
+            novos = dict(self.funcionarios)
+            for funcionario in funcionarios:
+                novos[funcionario.id] = funcionario
+            self.funcionarios = novos
+            for derivado in self._derivados():
+                derivado.atualizar(funcionarios)
+            self.versao += 1
+    def remover(self, id, versao_alteracao=None):
+        with self._lock:
+            if id in self.funcionarios:
+                novos = dict(self.funcionarios)
+                del novos[id]
+                self.funcionarios = novos
+            for derivado in self._derivados():
+                derivado.atualizar(removidos=[id])
+            if versao_alteracao is not None:
+                self._avancar_versao_banco(versao_alteracao, versao_alteracao)
+            self.versao += 1
+    def _avancar_versao_banco(self, primeira, ultima):
+        # Só avança se a escrita local for a próxima da sequência; senão outro processo
+        # escreveu no meio e sincronizar() precisa aplicar essas linhas
+        if primeira == self.versao_banco + 1:
+            self.versao_banco = ultima
+    @medir_fase("sincronizar")
+    def sincronizar(self):
+        # Aplica apenas as alterações feitas por outros processos desde a última versão vista.
+        # PRAGMA data_version só muda quando outra conexão grava, então o caso comum não consulta nada.
+        if not self.funcionarios:
+            return 0
+        with self._lock:
+            if self._conn_monitor is None:
+                self._conn_monitor = get_db_connection()
+            c = self._conn_monitor.cursor()
+            data_version = c.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._data_version:
+                return 0
+            self._data_version = data_version
+            primeira = c.execute('SELECT MIN(versao) FROM alteracoes').fetchone()[0]
+            if primeira is not None and primeira > self.versao_banco + 1:
+                # A poda já apagou alterações que este processo não viu: relê tudo do banco
+                self.versao_banco = versao_alteracoes(c)
+                self.funcionarios = Funcionario.ler_todos() if self.carregado else {}
+                self._descartar_derivados()
+                self.versao += 1
+                return len(self.funcionarios)
+            ultima_operacao = {}
+            versao_banco = self.versao_banco
+            for versao, id_funcionario, operacao in c.execute(
+                    'SELECT versao, id_funcionario, operacao FROM alteracoes WHERE versao > ? ORDER BY versao', (self.versao_banco,)):
+                ultima_operacao[id_funcionario] = operacao
+                versao_banco = versao
+            if not ultima_operacao:
+                return 0
+            self._aplicar(ultima_operacao)
+            self.versao_banco = versao_banco
+            return len(ultima_operacao)
+    def recarregar_ids(self, ids, versoes=None):
+        # Relê do banco só os funcionários alterados por uma escrita em massa deste processo
+        with self._lock:
+            self._aplicar({id: "salvar" for id in ids})
+            if versoes is not None:
+                self._avancar_versao_banco(*versoes)
+    def _aplicar(self, ultima_operacao):
+        if not self.carregado:
+            # Identity map parcial: só interessa quem já está em memória
+            ultima_operacao = {id: op for id, op in ultima_operacao.items() if id in self.funcionarios}
+            if not ultima_operacao:
+                return
+        novos = dict(self.funcionarios)
+        recarregados = Funcionario.ler_por_ids([id for id, op in ultima_operacao.items() if op == "salvar"])
+        for id_funcionario in ultima_operacao:
+            if id_funcionario in recarregados:
+                novos[id_funcionario] = recarregados[id_funcionario]
+            else:
+                novos.pop(id_funcionario, None)
+        self.funcionarios = novos
+        removidos = [id for id in ultima_operacao if id not in recarregados]
+        for derivado in self._derivados():
+            derivado.atualizar(recarregados.values(), removidos)
+        self.versao += 1
+    def invalidar(self):
+        with self._lock:
+            self.carregado = False
+            self.funcionarios = {}
+            self._descartar_derivados()
+            self.versao += 1
+    # Estruturas montadas a partir do elenco completo e mantidas a cada escrita (sob o lock)
+    def _derivados(self):
+        return [derivado for derivado in (self._indice_folgas, self._indice_nomes, self._cobertura) if derivado is not None]
+    def _descartar_derivados(self):
+        self._indice_folgas = None
+        self._indice_nomes = None
+        self._cobertura = None
+    def indice_folgas(self):
+        # Montado uma vez por carga completa do elenco; as escritas só atualizam os alterados
+        funcionarios = self.obter()
+        indice = self._indice_folgas
+        if indice is not None:
+            return indice
+        with self._lock:
+            indice = self._indice_folgas
+            if indice is None:
+                # Sob o lock: nenhuma escrita fica entre a montagem e o registro no cache
+                indice = IndiceFolgas((self.funcionarios if self.carregado else funcionarios).values())
+                if self.carregado:
+                    self._indice_folgas = indice
+            return indice
+    def indice_nomes(self):
+        funcionarios = self.obter()
+        indice = self._indice_nomes
+        if indice is not None:
+            return indice
+        with self._lock:
+            indice = self._indice_nomes
+            if indice is None:
+                indice = IndiceNomes((self.funcionarios if self.carregado else funcionarios).values())
+                if self.carregado:
+                    self._indice_nomes = indice
+            return indice
+    def cobertura(self):
+        # Montada uma vez por horizonte; depois só recebe as diferenças das escritas
+        funcionarios = self.obter()
+        inicio, fim = horizonte_cobertura()
+        with self._lock:
+            cobertura = self._cobertura
+            if cobertura is None or cobertura.inicio != inicio:
+                # Sob o lock: nenhuma escrita fica entre a montagem e o registro no cache
+                cobertura = CoberturaEscala(inicio, fim, (self.funcionarios if self.carregado else funcionarios).values())
+                if self.carregado:
+                    self._cobertura = cobertura
+            return cobertura
+    def estatisticas(self):
+        return {"acertos": self.acertos, "falhas": self.falhas, "versao": self.versao, "funcionarios": len(self.funcionarios)}
+
+# O script é reexecutado a cada rerun; cache_resource mantém a mesma instância para o processo todo
+@st.cache_resource
+def cache_do_elenco():
+    return CacheFuncionarios()
 
 # Classe Funcionario
 class Funcionario:
-    _funcionarios = {}
+    # Sem __dict__ por instância: o elenco inteiro fica em memória no cache compartilhado
+    __slots__ = ("_persistido", "_alterados", "id", "nome", "coren", "cargo", "tipo_vinculo", "data_admissao",
+                 "gerente", "turno", "local", "_senha_hash", "_folgas")
+    # Atributo -> coluna; alterações nesses atributos são rastreadas para o save gravar só o necessário
+    _CAMPOS = {"nome": "nome", "coren": "coren", "cargo": "cargo", "tipo_vinculo": "tipo_vinculo", "data_admissao": "data_admissao",
+               "gerente": "gerente", "turno": "turno", "local": "local", "_senha_hash": "senha_hash"}
+    # Poucos valores distintos repetidos no elenco todo: uma única cópia de cada string
+    _INTERNADOS = {"cargo", "tipo_vinculo", "turno", "local"}
     def __init__(self, id, nome, coren, cargo, tipo_vinculo, data_admissao, gerente=False, turno=None, local=None):
+        self._persistido = False
+        self._alterados = None  # criado só quando algo muda
         self.id = id
         self.nome = nome
         self.coren = coren
@@ -36,102 +693,784 @@ class Funcionario:
         self.turno = turno
         self.local = local
         self._senha_hash = None
-        self.folgas = []
+        self.folgas = IntervalosFolga()
+    @property
+    def folgas(self):
+        # Quem veio de obter_por_id só lê as folgas do banco no primeiro acesso
+        if self._folgas is None:
+            self._folgas = Funcionario.ler_folgas(self.id)
+        return self._folgas
+    def __setattr__(self, nome, valor):
+        if nome == "folgas":
+            if not isinstance(valor, IntervalosFolga):
+                valor = IntervalosFolga(valor)
+            # Lista substituída por inteiro: o save regrava todas as folgas
+            self._marcar_alterado(nome)
+            nome = "_folgas"
+        elif nome in Funcionario._CAMPOS:
+            if nome in Funcionario._INTERNADOS and type(valor) is str:
+                valor = sys.intern(valor)
+            if self._persistido and getattr(self, nome) != valor:
+                self._marcar_alterado(nome)
+        object.__setattr__(self, nome, valor)
+    def _marcar_alterado(self, nome):
+        if self._alterados is None:
+            self._alterados = set()
+        self._alterados.add(nome)
+    def _marcar_limpo(self):
+        self._persistido = True
+        self._alterados = None
+        if self._folgas is not None:
+            self._folgas.marcar_gravados()
+    def copia(self):
+        # Cópia para edição; o objeto compartilhado no cache só é trocado depois do commit
+        nova = object.__new__(Funcionario)
+        for nome in Funcionario.__slots__:
+            object.__setattr__(nova, nome, getattr(self, nome))
+        if self._alterados is not None:
+            object.__setattr__(nova, "_alterados", set(self._alterados))
+        if self._folgas is not None:
+            object.__setattr__(nova, "_folgas", self._folgas.copia())
+        return nova
     def set_senha(self, senha):
         self._senha_hash = hashlib.sha256(senha.encode()).hexdigest()
     def checa_senha(self, senha):
         return self._senha_hash == hashlib.sha256(senha.encode()).hexdigest()
+    def _valor_coluna(self, campo):
+        valor = getattr(self, campo)
+        if campo == "data_admissao":
+            return valor.isoformat()
+        if campo == "gerente":
+            return 1 if valor else 0
+        return valor
+    def alterado(self):
+        return not self._persistido or self._alterados is not None or (self._folgas is not None and bool(self._folgas.pendentes()))
+    def _gravar(self, c, folgas_novas):
+        # Emite só o que mudou; as folgas novas são acumuladas em folgas_novas para um único executemany
+        if not self._persistido:
+            c.execute('''INSERT OR REPLACE INTO funcionarios (id, nome, coren, cargo, tipo_vinculo, data_admissao, gerente, turno, local, senha_hash)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                      (self.id, *(self._valor_coluna(campo) for campo in Funcionario._CAMPOS)))
+        else:
+            campos = [campo for campo in Funcionario._CAMPOS if campo in (self._alterados or ())]
+            if campos:
+                atribuicoes = ", ".join(f"{Funcionario._CAMPOS[campo]} = ?" for campo in campos)
+                c.execute(f'UPDATE funcionarios SET {atribuicoes} WHERE id = ?', (*(self._valor_coluna(campo) for campo in campos), self.id))
+        if not self._persistido or "folgas" in (self._alterados or ()):
+            c.execute('DELETE FROM folgas WHERE id_funcionario = ?', (self.id,))
+            periodos = list(self.folgas)
+        else:
+            periodos = self._folgas.pendentes() if self._folgas is not None else []
+        folgas_novas.extend((self.id, inicio.isoformat(), fim.isoformat()) for inicio, fim in periodos)
     def save(self):
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('''INSERT OR REPLACE INTO funcionarios (id, nome, coren, cargo, tipo_vinculo, data_admissao, gerente, turno, local, senha_hash)
-                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (self.id, self.nome, self.coren, self.cargo, self.tipo_vinculo, self.data_admissao.isoformat(),
-                   1 if self.gerente else 0, self.turno, self.local, self._senha_hash))
-        c.execute('DELETE FROM folgas WHERE id_funcionario = ?', (self.id,))
-        for inicio, fim in self.folgas:
-            c.execute('INSERT INTO folgas (id_funcionario, data_inicio, data_fim) VALUES (?, ?, ?)',
-                      (self.id, inicio.isoformat(), fim.isoformat()))
-        conn.commit()
-        conn.close()
-        Funcionario._funcionarios[self.id] = self
-        if "funcionarios_state" not in st.session_state:
-            st.session_state["funcionarios_state"] = {}
-        st.session_state["funcionarios_state"][self.id] = self
+        Funcionario.save_many([self])
+    @classmethod
+    def save_many(cls, funcionarios):
+        # Unidade de trabalho: grava todos os funcionários alterados em uma única transação
+        gravados = [f for f in funcionarios if f.alterado()]
+        if not gravados:
+            return
+        folgas_novas = []
+        try:
+            with transacao() as c:
+                for f in gravados:
+                    f._gravar(c, folgas_novas)
+                if folgas_novas:
+                    c.executemany('INSERT INTO folgas (id_funcionario, data_inicio, data_fim) VALUES (?, ?, ?)', folgas_novas)
+                versoes = registrar_alteracoes(c, [f.id for f in gravados], "salvar")
+        except Exception:
+            # As alterações já foram feitas nos objetos compartilhados do cache: sem o commit,
+            # eles voltam ao que está gravado para nenhuma sessão ver (ou regravar) o que falhou
+            cache_do_elenco().recarregar_ids([f.id for f in gravados])
+            raise
+        for f in gravados:
+            f._marcar_limpo()
+        cache_do_elenco().atualizar(gravados, versoes)
+    def delete(self):
+        with transacao() as c:
+            c.execute('DELETE FROM folgas WHERE id_funcionario = ?', (self.id,))
+            c.execute('DELETE FROM funcionarios WHERE id = ?', (self.id,))
+            versao = registrar_alteracao(c, self.id, "excluir")
+        cache_do_elenco().remover(self.id, versao)
+    _COLUNAS = 'id, nome, coren, cargo, tipo_vinculo, data_admissao, gerente, turno, local, senha_hash'
+    @classmethod
+    def _de_linha(cls, row):
+        f = cls(row[0], row[1], row[2], row[3], row[4], parse_data(row[5]), bool(row[6]), row[7], row[8])
+        f._senha_hash = row[9]
+        return f
+    @classmethod
+    @medir_fase("load_all")
+    def ler_todos(cls, conn=None):
+        # Carga em lote: uma consulta para funcionários e outra para todas as folgas,
+        # agrupadas em uma única passada (evita uma consulta de folgas por funcionário).
+        # Sem conn, usa uma conexão do pool.
+        carregados = {}
+        with conexao() if conn is None else nullcontext(conn) as conn:
+            for row in conn.execute(f'SELECT {cls._COLUNAS} FROM funcionarios'):
+                carregados[row[0]] = cls._de_linha(row)
+            for id_funcionario, data_inicio, data_fim in conn.execute('SELECT id_funcionario, data_inicio, data_fim FROM folgas'):
+                f = carregados.get(id_funcionario)
+                if f is not None:
+                    f._folgas.adicionar_ordinais(ordinal_iso(data_inicio), ordinal_iso(data_fim))
+        for f in carregados.values():
+            f._marcar_limpo()
+        return carregados
+    @classmethod
+    def ler_um(cls, id):
+        with conexao() as conn:
+            row = conn.execute(f'SELECT {cls._COLUNAS} FROM funcionarios WHERE id = ?', (id,)).fetchone()
+        if row is None:
+            return None
+        f = cls._de_linha(row)
+        f._folgas = None  # carregadas sob demanda
+        f._marcar_limpo()
+        return f
+    @classmethod
+    def ler_folgas(cls, id):
+        with conexao() as conn:
+            folgas = IntervalosFolga()
+            for inicio, fim in conn.execute('SELECT data_inicio, data_fim FROM folgas WHERE id_funcionario = ?', (id,)):
+                folgas.adicionar_ordinais(ordinal_iso(inicio), ordinal_iso(fim))
+        folgas.marcar_gravados()
+        return folgas
+    @classmethod
+    def ler_por_ids(cls, ids):
+        carregados = {}
+        ids = list(ids)
+        if not ids:
+            return carregados
+        with conexao() as conn:
+            # Em blocos: uma importação em massa pode alterar mais ids do que o SQLite aceita em um IN (...)
+            for inicio in range(0, len(ids), 500):
+                bloco = ids[inicio:inicio + 500]
+                marcadores = ', '.join('?' * len(bloco))
+                for row in conn.execute(f'SELECT {cls._COLUNAS} FROM funcionarios WHERE id IN ({marcadores})', bloco):
+                    carregados[row[0]] = cls._de_linha(row)
+                for id_funcionario, data_inicio, data_fim in conn.execute(
+                        f'SELECT id_funcionario, data_inicio, data_fim FROM folgas WHERE id_funcionario IN ({marcadores})', bloco):
+                    f = carregados.get(id_funcionario)
+                    if f is not None:
+                        f._folgas.adicionar_ordinais(ordinal_iso(data_inicio), ordinal_iso(data_fim))
+        for f in carregados.values():
+            f._marcar_limpo()
+        return carregados
     @classmethod
     def load_all(cls):
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('SELECT * FROM funcionarios')
-        for row in c.fetchall():
-            f = cls(row[0], row[1], row[2], row[3], row[4], date.fromisoformat(row[5]), bool(row[6]), row[7], row[8])
-            f._senha_hash = row[9]
-            c.execute('SELECT data_inicio, data_fim FROM folgas WHERE id_funcionario = ?', (row[0],))
-            f.folgas = [tuple(date.fromisoformat(x) for x in folga) for folga in c.fetchall()]
-            cls._funcionarios[row[0]] = f
-        conn.close()
-        if "funcionarios_state" not in st.session_state:
-            st.session_state["funcionarios_state"] = {}
-        st.session_state["funcionarios_state"].update(cls._funcionarios)
+        # Força a releitura do banco para todas as sessões
+        return cache_do_elenco().recarregar()
+    @classmethod
+    def todos(cls):
+        return cache_do_elenco().obter()
     @classmethod
     def get_funcionario_por_id(cls, id):
-        if not cls._funcionarios:
-            cls.load_all()
-        return cls._funcionarios.get(id)
+        return cache_do_elenco().obter_por_id(id)
+    @classmethod
+    def buscar_por_nome(cls, nome, limite=None, offset=0):
+        return cls.paginar_busca(nome, limite, offset)[0]
     @classmethod
-    def buscar_por_nome(cls, nome):
-        if not cls._funcionarios:
-            cls.load_all()
-        nome = nome.strip().lower()
-        return [f for f in cls._funcionarios.values() if f.nome.strip().lower().find(nome) != -1]
+    def paginar_busca(cls, nome, limite=None, offset=0):
+        # (página de resultados ranqueados, total de resultados)
+        funcionarios = cls.todos()
+        ids = cache_do_elenco().indice_nomes().buscar(nome)
+        fim = None if limite is None else offset + limite
+        return [funcionarios[id] for id in ids[offset:fim] if id in funcionarios], len(ids)
     @classmethod
     def buscar_por_dia(cls, dia, mes, ano, last_day_parity=None):
-        if not cls._funcionarios:
-            cls.load_all()
+        # Consulta de um único dia para scripts e para o benchmark; as telas usam calcular_escala.
+        # Não preenche o local vazio: quem exibe usa f.local or "UH", sem tocar nos objetos do cache
         prestadores = []
         data_consulta = date(ano, mes, dia)
-        for f in cls._funcionarios.values():
+        de_folga = cache_do_elenco().indice_folgas().ids_em_folga(data_consulta)
+        grupo = grupo_de_plantao(dia, bool(last_day_parity))
+        for f in cls.todos().values():
             if f.turno:
-                em_folga = any(data_inicio <= data_consulta <= data_fim for data_inicio, data_fim in f.folgas)
-                if not em_folga:
-                    if last_day_parity is None:
-                        if (f.turno == "Dia 1" and dia % 2 == 1) or (f.turno == "Dia 2" and dia % 2 == 0) or \
-                           (f.turno == "Noite 1" and dia % 2 == 1) or (f.turno == "Noite 2" and dia % 2 == 0):
-                            prestadores.append(f)
-                    else:
-                        if last_day_parity:
-                            if (f.turno == "Dia 2" and dia % 2 == 1) or (f.turno == "Dia 1" and dia % 2 == 0) or \
-                               (f.turno == "Noite 2" and dia % 2 == 1) or (f.turno == "Noite 1" and dia % 2 == 0):
-                                prestadores.append(f)
-                        else:
-                            if (f.turno == "Dia 1" and dia % 2 == 1) or (f.turno == "Dia 2" and dia % 2 == 0) or \
-                               (f.turno == "Noite 1" and dia % 2 == 1) or (f.turno == "Noite 2" and dia % 2 == 0):
-                                prestadores.append(f)
+                if f.id not in de_folga:
+                    if f.turno in TURNOS and f.turno[-1] == grupo:
+                        prestadores.append(f)
                 else:
                     # Adiciona mesmo em folga para poder mostrar na escala
                     prestadores.append(f)
-            if not f.local:
-                f.local = "UH"
         return prestadores
 
+# =============================================================================
+# MOTOR DA ESCALA
+# =============================================================================
+TURNOS = ["Dia 1", "Dia 2", "Noite 1", "Noite 2"]
+# Códigos da matriz dia × funcionário
+FORA, DIA, NOITE, FOLGA = 0, 1, 2, 3
+
+# Turnos "1" trabalham nos dias ímpares e "2" nos pares; quando o mês termina em dia par
+# (last_day_parity) a alternância inverte, para não repetir o plantão na virada do mês
+def grupo_de_plantao(dia, last_day_parity):
+    return "1" if (dia % 2 == 1) != last_day_parity else "2"
+
+class Escala:
+    def __init__(self, inicio, funcionarios, matriz):
+        self.inicio = inicio
+        self.funcionarios = funcionarios  # ordenados por nome
+        self.matriz = matriz
+    @property
+    def dias(self):
+        return [self.inicio + timedelta(days=i) for i in range(self.matriz.shape[0])]
+    def linha(self, data):
+        return self.matriz[data.toordinal() - self.inicio.toordinal()]
+    def do_dia(self, data):
+        # (plantão dia, plantão noite, folga) já em ordem alfabética
+        linha = self.linha(data)
+        return tuple([self.funcionarios[i] for i in np.flatnonzero(linha == codigo)] for codigo in (DIA, NOITE, FOLGA))
+
+# Calcula a escala de [inicio, fim] para todo o elenco de uma vez, com máscaras NumPy
+# de paridade e de folga, em vez de chamar buscar_por_dia dia a dia
+@medir_fase("escala")
+def calcular_escala(inicio, fim, funcionarios=None):
+    if funcionarios is None:
+        funcionarios = Funcionario.todos().values()
+    funcionarios = sorted((f for f in funcionarios if f.turno), key=lambda f: f.nome)
+    dias = [inicio + timedelta(days=i) for i in range((fim - inicio).days + 1)]
+    dia_impar = np.array([d.day % 2 == 1 for d in dias])
+    ultimo_par = np.array([calendar.monthrange(d.year, d.month)[1] % 2 == 0 for d in dias])
+    turnos = [f.turno for f in funcionarios]
+    valido = np.array([t in TURNOS for t in turnos], dtype=bool)
+    grupo_1 = np.array([t.endswith("1") for t in turnos], dtype=bool)
+    noite = np.array([t.startswith("Noite") for t in turnos], dtype=bool)
+    # Grupo "1" de plantão quando dia ímpar XOR mês com último dia par
+    de_plantao = ((dia_impar != ultimo_par)[:, None] == grupo_1[None, :]) & valido[None, :]
+    matriz = np.where(de_plantao, np.where(noite, NOITE, DIA)[None, :], FORA).astype(np.int8)
+    base = inicio.toordinal()
+    for j, f in enumerate(funcionarios):
+        for a, b in f.folgas.sobrepostos(inicio, fim):
+            matriz[max(a.toordinal(), base) - base:min(b.toordinal(), fim.toordinal()) - base + 1, j] = FOLGA
+    return Escala(inicio, funcionarios, matriz)
+
+def escala_do_mes(ano, mes):
+    return calcular_escala(date(ano, mes, 1), date(ano, mes, calendar.monthrange(ano, mes)[1]))
+
+# --- RENDERIZAÇÃO DO CALENDÁRIO DE UMA QUINZENA ---
+# Trechos fixos do HTML montados uma vez; a célula só preenche nome e local
+_DIAS_DA_SEMANA = ["Domingo", "Segunda", "Terça", "Quarta", "Quinta", "Sexta", "Sábado"]
+_TABELA_INICIO = ("<table style='width: 100%; border-collapse: collapse;'><thead><tr>"
+                  + "".join([f"<th style='border: 1px solid #ccc; padding: 4px; text-align: center; font-size: 8pt; width: 14%;'>{d}</th>" for d in _DIAS_DA_SEMANA])
+                  + "</tr></thead><tbody>")
+_TD_VAZIO = "<td style='border: 1px solid #ccc; height: 100px;'></td>"
+_TITULO_GRUPO = "<div style='font-size: 7pt; text-align: center; font-weight: bold; background-color: #e0e0e0;'>{}</div>"
+_NOME_DIA = "<div style='font-size: 6pt; background-color: #d1e7ff; padding: 1px; margin-top: 1px; border-radius: 2px;'>{} - {}</div>"
+_NOME_NOITE = "<div style='font-size: 6pt; background-color: #ffd1dc; padding: 1px; margin-top: 1px; border-radius: 2px;'>{} - {}</div>"
+_NOME_FOLGA = "<div style='font-size: 6pt; background-color: #f0f0f0; padding: 1px; margin-top: 1px; border-radius: 2px;'>{}</div>"
+
+@medir_fase("html do calendário")
+def render_calendar_html(ano, mes, start_day, end_day, escala=None):
+    if escala is None:
+        escala = escala_do_mes(ano, mes)
+    calendar.setfirstweekday(calendar.SUNDAY) # Começa a semana no Domingo
+    # As partes vão para uma lista e são unidas no fim, sem concatenações sucessivas de string
+    partes = [_TABELA_INICIO]
+    for semana in calendar.monthcalendar(ano, mes):
+        partes.append("<tr>")
+        for dia in semana:
+            if dia == 0 or not (start_day <= dia <= end_day):
+                partes.append(_TD_VAZIO)
+                continue
+
+            partes.append(f"<td style='border: 1px solid #ccc; vertical-align: top; padding: 2px;'><div style='font-weight: bold; text-align: center;'>{dia}</div>")
+            prestadores_dia, prestadores_noite, folgas = escala.do_dia(date(ano, mes, dia))
+            if prestadores_dia:
+                partes.append(_TITULO_GRUPO.format("7h-19h"))
+                partes.extend(_NOME_DIA.format(p.nome.split()[0], p.local or "UH") for p in prestadores_dia)
+            if prestadores_noite:
+                partes.append(_TITULO_GRUPO.format("19h-7h"))
+                partes.extend(_NOME_NOITE.format(p.nome.split()[0], p.local or "UH") for p in prestadores_noite)
+            if folgas:
+                partes.append(_TITULO_GRUPO.format("Folga"))
+                partes.extend(_NOME_FOLGA.format(p.nome.split()[0]) for p in folgas)
+            partes.append("</td>")
+        partes.append("</tr>")
+    partes.append("</tbody></table>")
+    return "".join(partes)
+
+# Cache LRU limitado, compartilhado entre sessões, para escalas e HTML já renderizados
+class CacheLRU:
+    def __init__(self, maximo=32):
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()
+        self.maximo = maximo
+        self.acertos = 0
+        self.falhas = 0
+    def obter(self, chave, gerar):
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return self._itens[chave]
+            self.falhas += 1
+        valor = gerar()
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maximo:
+                self._itens.popitem(last=False)
+        return valor
+
+@st.cache_resource
+def cache_de_calendarios():
+    return CacheLRU()
+
+# HTML da quinzena pela chave (ano, mês, dias, versão do elenco): um acerto pula
+# tanto o cálculo da escala quanto a geração do HTML
+def calendario_html(ano, mes, start_day, end_day):
+    cache = cache_de_calendarios()
+    elenco = cache_do_elenco()
+    elenco.obter()  # carrega o elenco antes de ler a versão, senão a primeira chave fica desatualizada
+    versao = elenco.versao
+    def gerar():
+        escala = cache.obter(("escala", ano, mes, versao), lambda: escala_do_mes(ano, mes))
+        return render_calendar_html(ano, mes, start_day, end_day, escala)
+    return cache.obter(("html", ano, mes, start_day, end_day, versao), gerar)
+
+# =============================================================================
+# MANUTENÇÃO DIÁRIA
+# =============================================================================
+VINCULO_ANJO = "AJ - PROGRAMA ANJO"
+VINCULO_EFETIVADO = "FT - EFETIVADO"
+DIAS_PROGRAMA_ANJO = 7
+
+# Efetiva quem está no Programa Anjo há 7 dias ou mais. Roda no máximo uma vez por dia por banco:
+# o marcador em `manutencao` é lido e gravado sob o lock de escrita (BEGIN IMMEDIATE), então
+# só o primeiro processo do dia executa; os demais veem o marcador e saem.
+@medir_fase("promoção AJ→FT")
+def promover_programa_anjo(hoje=None):
+    hoje = hoje or date.today()
+    cache = cache_do_elenco()
+    if cache.ultima_manutencao == hoje:
+        return []
+    limite = (hoje - timedelta(days=DIAS_PROGRAMA_ANJO)).isoformat()
+    ids, versoes = [], None
+    with transacao() as c:
+        marcador = c.execute('SELECT ultima_execucao FROM manutencao WHERE tarefa = ?', ("promover_programa_anjo",)).fetchone()
+        if marcador is None or marcador[0] < hoje.isoformat():
+            ids = [row[0] for row in c.execute('SELECT id FROM funcionarios WHERE tipo_vinculo = ? AND data_admissao <= ?', (VINCULO_ANJO, limite))]
+            if ids:
+                c.execute('UPDATE funcionarios SET tipo_vinculo = ? WHERE tipo_vinculo = ? AND data_admissao <= ?', (VINCULO_EFETIVADO, VINCULO_ANJO, limite))
+                versoes = registrar_alteracoes(c, ids, "salvar")
+            c.execute('INSERT OR REPLACE INTO manutencao (tarefa, ultima_execucao) VALUES (?, ?)', ("promover_programa_anjo", hoje.isoformat()))
+    cache.ultima_manutencao = hoje
+    if ids:
+        cache.recarregar_ids(ids, versoes)
+    return ids
+
+DIAS_RETENCAO_ALTERACOES = 30
+
+# Apaga do registro de alterações o que tem mais de 30 dias, uma vez por dia como a promoção.
+# A linha mais recente sempre fica: MIN(versao) mostra a quem sincroniza se perdeu alguma.
+@medir_fase("poda de alterações")
+def podar_alteracoes(hoje=None):
+    hoje = hoje or date.today()
+    cache = cache_do_elenco()
+    if cache.ultima_poda == hoje:
+        return 0
+    limite = (hoje - timedelta(days=DIAS_RETENCAO_ALTERACOES)).isoformat()
+    podadas = 0
+    with transacao() as c:
+        marcador = c.execute('SELECT ultima_execucao FROM manutencao WHERE tarefa = ?', ("podar_alteracoes",)).fetchone()
+        if marcador is None or marcador[0] < hoje.isoformat():
+            # Sempre um prefixo das versões, para a comparação com MIN(versao) valer
+            c.execute('''DELETE FROM alteracoes
+                         WHERE versao <= (SELECT MAX(versao) FROM alteracoes WHERE criado_em IS NULL OR criado_em < ?)
+                           AND versao < (SELECT MAX(versao) FROM alteracoes)''', (limite,))
+            podadas = c.rowcount
+            c.execute('INSERT OR REPLACE INTO manutencao (tarefa, ultima_execucao) VALUES (?, ?)', ("podar_alteracoes", hoje.isoformat()))
+    cache.ultima_poda = hoje
+    return podadas
+
+# =============================================================================
+# IMPORTAÇÃO E EXPORTAÇÃO EM CSV
+# =============================================================================
+LOCAIS = ["UH", "UCCI"]
+VINCULOS = [VINCULO_ANJO, VINCULO_EFETIVADO]
+# Senha e perfil de gerente não entram no CSV; na importação os valores já gravados são mantidos
+COLUNAS_PRESTADORES = ["id", "nome", "coren", "cargo", "tipo_vinculo", "data_admissao", "turno", "local"]
+OBRIGATORIAS_PRESTADORES = ["id", "nome", "coren", "cargo", "tipo_vinculo", "data_admissao"]
+COLUNAS_FOLGAS = ["id_funcionario", "data_inicio", "data_fim"]
+# Linhas validadas e gravadas por vez; também limita os parâmetros de cada IN (...)
+LOTE_CSV = 500
+# Importações maiores que isso descartam o cache do elenco em vez de reler funcionário por funcionário
+LIMITE_RECARGA_POR_IDS = 2000
+
+class ResultadoImportacao:
+    def __init__(self):
+        self.prestadores = 0
+        self.folgas = 0
+        self.folgas_repetidas = 0
+        self.erros = []  # (arquivo, linha, mensagem)
+    def erro(self, arquivo, linha, mensagem):
+        self.erros.append((arquivo, linha, mensagem))
+
+# ISO (2024-03-01) ou o formato usado nas telas (01/03/2024)
+def ler_data_csv(texto):
+    try:
+        if "/" in texto:
+            return datetime.strptime(texto, "%d/%m/%Y").date()
+        return date.fromisoformat(texto)
+    except ValueError:
+        raise ValueError(f"data inválida: {texto!r}")
+
+# (número da linha no arquivo, linha) em lotes de LOTE_CSV, lendo o arquivo aos poucos
+def _linhas_em_lotes(arquivo, colunas, nome):
+    leitor = csv.DictReader(arquivo)
+    faltando = [coluna for coluna in colunas if coluna not in (leitor.fieldnames or ())]
+    if faltando:
+        raise ValueError(f"{nome}: coluna(s) ausente(s) no cabeçalho: {', '.join(faltando)}")
+    linhas = ((leitor.line_num, {chave: (valor or "").strip() for chave, valor in row.items() if chave}) for row in leitor)
+    return iter(lambda: list(islice(linhas, LOTE_CSV)), [])
+
+def _validar_prestador(row):
+    vazias = [coluna for coluna in OBRIGATORIAS_PRESTADORES if not row[coluna]]
+    if vazias:
+        raise ValueError(f"campo(s) obrigatório(s) vazio(s): {', '.join(vazias)}")
+    if row["tipo_vinculo"] not in VINCULOS:
+        raise ValueError(f"tipo_vinculo inválido: {row['tipo_vinculo']!r}")
+    if row["turno"] and row["turno"] not in TURNOS:
+        raise ValueError(f"turno inválido: {row['turno']!r}")
+    if row["local"] and row["local"] not in LOCAIS:
+        raise ValueError(f"local inválido: {row['local']!r}")
+    return (row["id"], row["nome"], row["coren"], row["cargo"], sys.intern(row["tipo_vinculo"]),
+            ler_data_csv(row["data_admissao"]).isoformat(), row["turno"] or None, row["local"] or None)
+
+def _importar_prestadores(c, arquivo, resultado, alterados):
+    for lote in _linhas_em_lotes(arquivo, COLUNAS_PRESTADORES, "prestadores"):
+        validos = []
+        for linha, row in lote:
+            try:
+                valores = _validar_prestador(row)
+            except ValueError as e:
+                resultado.erro("prestadores", linha, str(e))
+                continue
+            if valores[0] in alterados:
+                resultado.erro("prestadores", linha, f"matrícula repetida no arquivo: {valores[0]!r}")
+                continue
+            alterados.add(valores[0])
+            validos.append(valores)
+        # Matrícula já cadastrada: atualiza os dados e preserva senha e perfil de gerente;
+        # turno e local vazios no CSV mantêm o agendamento atual em vez de apagá-lo
+        c.executemany('''INSERT INTO funcionarios (id, nome, coren, cargo, tipo_vinculo, data_admissao, gerente, turno, local)
+                         VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)
+                         ON CONFLICT(id) DO UPDATE SET nome = excluded.nome, coren = excluded.coren, cargo = excluded.cargo,
+                             tipo_vinculo = excluded.tipo_vinculo, data_admissao = excluded.data_admissao,
+                             turno = COALESCE(excluded.turno, funcionarios.turno),
+                             local = COALESCE(excluded.local, funcionarios.local)''', validos)
+        resultado.prestadores += len(validos)
+
+def _importar_folgas(c, arquivo, resultado, alterados):
+    # Funcionários já consultados e o que se sabe deles valem para os lotes seguintes: cada lote
+    # só consulta os ids que ainda não apareceram, e as folgas inseridas entram em registradas
+    consultados = set()
+    existentes = set()
+    registradas = set()
+    for lote in _linhas_em_lotes(arquivo, COLUNAS_FOLGAS, "folgas"):
+        # Uma consulta por lote para os funcionários novos e outra para as folgas que eles já têm;
+        # dentro da transação, os prestadores importados acima já aparecem
+        ids = list({row["id_funcionario"] for _, row in lote if row["id_funcionario"]} - consultados)
+        if ids:
+            consultados.update(ids)
+            marcadores = ', '.join('?' * len(ids))
+            existentes.update(row[0] for row in c.execute(f'SELECT id FROM funcionarios WHERE id IN ({marcadores})', ids))
+            registradas.update(c.execute(f'SELECT id_funcionario, data_inicio, data_fim FROM folgas WHERE id_funcionario IN ({marcadores})', ids))
+        validas = []
+        for linha, row in lote:
+            try:
+                if not row["id_funcionario"]:
+                    raise ValueError("id_funcionario vazio")
+                if row["id_funcionario"] not in existentes:
+                    raise ValueError(f"funcionário não cadastrado: {row['id_funcionario']!r}")
+                inicio, fim = ler_data_csv(row["data_inicio"]), ler_data_csv(row["data_fim"])
+                if inicio > fim:
+                    raise ValueError("data_inicio posterior a data_fim")
+            except ValueError as e:
+                resultado.erro("folgas", linha, str(e))
+                continue
+            folga = (row["id_funcionario"], inicio.isoformat(), fim.isoformat())
+            if folga in registradas:
+                # Reimportar o mesmo arquivo não duplica períodos
+                resultado.folgas_repetidas += 1
+                continue
+            registradas.add(folga)
+            alterados.add(folga[0])
+            validas.append(folga)
+        c.executemany('INSERT INTO folgas (id_funcionario, data_inicio, data_fim) VALUES (?, ?, ?)', validas)
+        resultado.folgas += len(validas)
+
+# Importa arquivos de texto CSV (com cabeçalho) em uma única transação: linhas com erro ficam de fora
+# e vão para o relatório; um cabeçalho incompleto cancela a importação inteira. Os prestadores
+# entram antes das folgas para que as folgas possam se referir a quem acabou de ser importado.
+@medir_fase("importar csv")
+def importar_csv(prestadores=None, folgas=None):
+    resultado = ResultadoImportacao()
+    alterados = set()
+    versoes = None
+    with transacao() as c:
+        if prestadores is not None:
+            _importar_prestadores(c, prestadores, resultado, alterados)
+        if folgas is not None:
+            _importar_folgas(c, folgas, resultado, alterados)
+        if alterados:
+            versoes = registrar_alteracoes(c, list(alterados), "salvar")
+    cache = cache_do_elenco()
+    if len(alterados) > LIMITE_RECARGA_POR_IDS:
+        cache.invalidar()
+    elif alterados:
+        cache.recarregar_ids(alterados, versoes)
+    return resultado
+
+# Exportação no mesmo formato aceito pela importação: gera o texto em pedaços direto do cursor,
+# sem montar o arquivo inteiro em memória
+def _exportar_csv(colunas, sql):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(colunas)
+    with conexao() as conn:
+        cursor = conn.execute(sql)
+        while True:
+            escritor.writerows(cursor.fetchmany(LOTE_CSV))
+            pedaco = buffer.getvalue()
+            if not pedaco:
+                return
+            yield pedaco
+            buffer.seek(0)
+            buffer.truncate()
+
+def exportar_prestadores_csv():
+    return _exportar_csv(COLUNAS_PRESTADORES, f'SELECT {", ".join(COLUNAS_PRESTADORES)} FROM funcionarios ORDER BY id')
+
+def exportar_folgas_csv():
+    return _exportar_csv(COLUNAS_FOLGAS, 'SELECT id_funcionario, data_inicio, data_fim FROM folgas ORDER BY id_funcionario, data_inicio')
+
+# =============================================================================
+# EXPORTAÇÃO DA ESCALA EM LOTE
+# =============================================================================
+# Escalas de vários meses e locais sem navegador: cada mês é uma tarefa de um pool de processos
+# e todos leem a mesma cópia somente-leitura do banco, tirada uma única vez no início
+_DOCUMENTO_ESCALA = ("<!DOCTYPE html><html lang='pt-BR'><head><meta charset='utf-8'><title>{titulo}</title>"
+                     "<style>body {{ font-family: sans-serif; }} .quinzena {{ page-break-after: always; }}</style>"
+                     "</head><body>{corpo}</body></html>")
+_QUINZENA_ESCALA = "<div class='quinzena'><h3>{} - Dias {} a {}</h3>{}</div>"
+_PLANTOES = ("7h-19h", "19h-7h", "Folga")
+
+# (ano, mês) de inicio a fim, inclusive
+def meses_do_periodo(inicio, fim):
+    ano, mes = inicio
+    meses = []
+    while (ano, mes) <= fim:
+        meses.append((ano, mes))
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return meses
+
+# Documento imprimível com as duas quinzenas do mês, uma por página
+def escala_html(ano, mes, local, escala):
+    titulo = f"Escala de {calendar.month_name[mes]} {ano} - {local}"
+    ultimo_dia = calendar.monthrange(ano, mes)[1]
+    corpo = "".join(_QUINZENA_ESCALA.format(titulo, inicio, fim, render_calendar_html(ano, mes, inicio, fim, escala))
+                    for inicio, fim in ((1, 15), (16, ultimo_dia)))
+    return _DOCUMENTO_ESCALA.format(titulo=titulo, corpo=corpo)
+
+# Uma linha por pessoa escalada ou de folga em cada dia
+def escala_csv(escala):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(["data", "dia_da_semana", "plantao", "id", "nome", "turno"])
+    for data in escala.dias:
+        dia_da_semana = _DIAS_DA_SEMANA[(data.weekday() + 1) % 7]
+        for plantao, prestadores in zip(_PLANTOES, escala.do_dia(data)):
+            escritor.writerows([data.isoformat(), dia_da_semana, plantao, p.id, p.nome, p.turno] for p in prestadores)
+    return buffer.getvalue()
+
+# Elenco lido do snapshot, uma vez por processo do pool
+_elenco_do_snapshot = None
+
+def _abrir_snapshot(caminho):
+    global _elenco_do_snapshot
+    # as_uri escapa espaços, "?", "#" e "%" do caminho
+    conn = sqlite3.connect(pathlib.Path(caminho).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        _elenco_do_snapshot = Funcionario.ler_todos(conn)
+    finally:
+        conn.close()
+
+def _exportar_mes(ano, mes, pasta, locais, formatos):
+    inicio, fim = date(ano, mes, 1), date(ano, mes, calendar.monthrange(ano, mes)[1])
+    gravados = []
+    for local in locais:
+        escala = calcular_escala(inicio, fim, [f for f in _elenco_do_snapshot.values() if (f.local or "UH") == local])
+        for formato in formatos:
+            caminho = os.path.join(pasta, f"escala_{ano}-{mes:02d}_{local}.{formato}")
+            with open(caminho, "w", encoding="utf-8", newline="") as arquivo:
+                arquivo.write(escala_html(ano, mes, local, escala) if formato == "html" else escala_csv(escala))
+            gravados.append(caminho)
+    return gravados
+
+# Gera os caminhos dos arquivos gravados à medida que cada mês termina
+def exportar_escalas(meses, pasta, locais=None, formatos=("html", "csv"), processos=None):
+    if not meses:
+        return
+    os.makedirs(pasta, exist_ok=True)
+    with tempfile.TemporaryDirectory() as temporaria:
+        snapshot = os.path.join(temporaria, "cotolengo.db")
+        copia = sqlite3.connect(snapshot)
+        try:
+            with conexao() as conn:
+                conn.backup(copia)
+            # Sem WAL a cópia pode ser aberta com mode=ro sem criar arquivos -wal/-shm
+            copia.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            copia.close()
+        processos = min(processos or os.cpu_count() or 1, len(meses))
+        with ProcessPoolExecutor(processos, initializer=_abrir_snapshot, initargs=(snapshot,)) as pool:
+            tarefas = [pool.submit(_exportar_mes, ano, mes, pasta, locais or LOCAIS, formatos) for ano, mes in meses]
+            for tarefa in as_completed(tarefas):
+                yield from tarefa.result()
+
+# =============================================================================
+# COBERTURA DA ESCALA
+# =============================================================================
+# Mínimo de pessoas por plantão em cada local; dias abaixo disso geram alerta
+MINIMO_POR_PLANTAO = {"UH": {DIA: 2, NOITE: 2}, "UCCI": {DIA: 2, NOITE: 2}}
+# Período coberto: do início do mês de 3 meses atrás ao fim do mês daqui a 12 meses
+COBERTURA_MESES_ANTES = 3
+COBERTURA_MESES_DEPOIS = 12
+
+def horizonte_cobertura(hoje=None):
+    hoje = hoje or date.today()
+    mes_atual = hoje.year * 12 + hoje.month - 1
+    ano, mes = divmod(mes_atual - COBERTURA_MESES_ANTES, 12)
+    inicio = date(ano, mes + 1, 1)
+    ano, mes = divmod(mes_atual + COBERTURA_MESES_DEPOIS, 12)
+    return inicio, date(ano, mes + 1, calendar.monthrange(ano, mes + 1)[1])
+
+# Pessoas por dia, local e plantão (dia, noite, folga) nas mesmas regras de calcular_escala,
+# guardadas também como somas prefixadas: total de um intervalo e número de dias abaixo do
+# mínimo saem em O(1). Cada funcionário entra como um registro (local, plantão, grupo, folgas);
+# um save que muda turno, local ou folgas soma só a diferença entre o registro antigo e o novo.
+class CoberturaEscala:
+    def __init__(self, inicio, fim, funcionarios):
+        self.inicio = inicio
+        self.fim = fim
+        self.dias = (fim - inicio).days + 1
+        dias = [inicio + timedelta(days=i) for i in range(self.dias)]
+        # Dias de plantão do grupo "1" (o grupo "2" trabalha nos demais)
+        self._grupo_1 = np.array([grupo_de_plantao(d.day, calendar.monthrange(d.year, d.month)[1] % 2 == 0) == "1" for d in dias])
+        self._minimos = np.array([[MINIMO_POR_PLANTAO[local][DIA], MINIMO_POR_PLANTAO[local][NOITE]] for local in LOCAIS])[:, :, None]
+        self._registros = {}
+        for f in funcionarios:
+            registro = self._registro(f)
+            if registro is not None:
+                self._registros[f.id] = registro
+        contagens = self._contagens(self._registros.values())
+        prefixo = np.zeros((len(LOCAIS), 3, self.dias + 1), dtype=np.int32)
+        prefixo[:, :, 1:] = np.cumsum(contagens, axis=2)
+        self._estado = (contagens, prefixo, self._prefixo_falta(contagens))
+    def _registro(self, f):
+        # Sem turno a pessoa não aparece na escala, nem de folga
+        if not f.turno or (f.local or "UH") not in LOCAIS:
+            return None
+        plantao = (NOITE if f.turno.startswith("Noite") else DIA) if f.turno in TURNOS else FORA
+        base, ultimo = self.inicio.toordinal(), self.fim.toordinal()
+        folgas = tuple((max(a.toordinal(), base) - base, min(b.toordinal(), ultimo) - base)
+                       for a, b in f.folgas.sobrepostos(self.inicio, self.fim))
+        return LOCAIS.index(f.local or "UH"), plantao, f.turno.endswith("1"), folgas
+    def _contagens(self, registros):
+        # Agrupa quem tem o mesmo local, plantão e grupo; as folgas entram por vetor de diferenças
+        grupos = {}
+        for local, plantao, grupo_1, folgas in registros:
+            grupo = grupos.setdefault((local, plantao, grupo_1), [0, []])
+            grupo[0] += 1
+            grupo[1].extend(folgas)
+        contagens = np.zeros((len(LOCAIS), 3, self.dias), dtype=np.int32)
+        for (local, plantao, grupo_1), (pessoas, folgas) in grupos.items():
+            diferencas = np.zeros(self.dias + 1, dtype=np.int32)
+            if folgas:
+                inicios, fins = np.array(folgas).T
+                np.add.at(diferencas, inicios, 1)
+                np.add.at(diferencas, fins + 1, -1)
+            em_folga = np.cumsum(diferencas[:-1])
+            contagens[local, FOLGA - 1] += em_folga
+            if plantao != FORA:
+                de_plantao = self._grupo_1 == grupo_1
+                contagens[local, plantao - 1] += de_plantao * (pessoas - em_folga)
+        return contagens
+    def _prefixo_falta(self, contagens):
+        prefixo_falta = np.zeros((len(LOCAIS), 2, self.dias + 1), dtype=np.int32)
+        prefixo_falta[:, :, 1:] = np.cumsum(contagens[:, :2] < self._minimos, axis=2)
+        return prefixo_falta
+    def atualizar(self, funcionarios=(), removidos=()):
+        # Chamado pelo cache do elenco, sob o lock dele, a cada escrita
+        antigos, novos = [], []
+        for f in funcionarios:
+            registro = self._registro(f)
+            anterior = self._registros.get(f.id)
+            if registro == anterior:
+                continue
+            if anterior is not None:
+                antigos.append(anterior)
+            if registro is not None:
+                novos.append(registro)
+                self._registros[f.id] = registro
+            else:
+                del self._registros[f.id]
+        for id in removidos:
+            anterior = self._registros.pop(id, None)
+            if anterior is not None:
+                antigos.append(anterior)
+        if not antigos and not novos:
+            return
+        contagens, prefixo, _ = self._estado
+        diferenca = self._contagens(novos) - self._contagens(antigos)
+        contagens = contagens + diferenca
+        prefixo = prefixo.copy()
+        prefixo[:, :, 1:] += np.cumsum(diferenca, axis=2)
+        # Troca o estado inteiro de uma vez: consultas em andamento veem o antigo ou o novo
+        self._estado = (contagens, prefixo, self._prefixo_falta(contagens))
+    def _intervalo(self, inicio, fim):
+        if inicio > fim or inicio < self.inicio or fim > self.fim:
+            raise ValueError(f"período fora da cobertura ({self.inicio:%d/%m/%Y} a {self.fim:%d/%m/%Y})")
+        base = self.inicio.toordinal()
+        return inicio.toordinal() - base, fim.toordinal() - base + 1
+    def total(self, local, plantao, inicio, fim):
+        # Soma de pessoas-dia no plantão (DIA, NOITE ou FOLGA) entre inicio e fim, inclusive
+        a, b = self._intervalo(inicio, fim)
+        prefixo = self._estado[1][LOCAIS.index(local), plantao - 1]
+        return int(prefixo[b] - prefixo[a])
+    def dias_abaixo_do_minimo(self, local, plantao, inicio, fim):
+        a, b = self._intervalo(inicio, fim)
+        prefixo_falta = self._estado[2][LOCAIS.index(local), plantao - 1]
+        return int(prefixo_falta[b] - prefixo_falta[a])
+    def por_dia(self, local, plantao, inicio, fim):
+        a, b = self._intervalo(inicio, fim)
+        return self._estado[0][LOCAIS.index(local), plantao - 1, a:b]
+    def alertas(self, local, inicio, fim):
+        # (data, plantão, pessoas, mínimo) de cada dia abaixo do mínimo; só percorre o
+        # intervalo quando as somas prefixadas indicam que há algum
+        a, b = self._intervalo(inicio, fim)
+        contagens, _, prefixo_falta = self._estado
+        indice = LOCAIS.index(local)
+        alertas = []
+        for plantao in (DIA, NOITE):
+            if prefixo_falta[indice, plantao - 1, b] == prefixo_falta[indice, plantao - 1, a]:
+                continue
+            pessoas = contagens[indice, plantao - 1, a:b]
+            minimo = MINIMO_POR_PLANTAO[local][plantao]
+            alertas.extend((inicio + timedelta(days=int(i)), plantao, int(pessoas[i]), minimo) for i in np.flatnonzero(pessoas < minimo))
+        return sorted(alertas)
+
 # Inicializa o estado da sessão e atualiza tipo_vinculo automaticamente
+@medir_fase("init_session")
 def init_session():
     init_db()
     if "autenticado" not in st.session_state:
         st.session_state["autenticado"] = False
         st.session_state["usuario"] = None
         st.session_state["pagina"] = "login"
-    if "funcionarios_state" not in st.session_state:
-        st.session_state["funcionarios_state"] = {}
-    Funcionario._funcionarios = st.session_state.get("funcionarios_state", {})
-    Funcionario.load_all()
-    hoje = date.today()
-    for funcionario in Funcionario._funcionarios.values():
-        if funcionario.tipo_vinculo == "AJ - PROGRAMA ANJO":
-            dias_desde_admissao = (hoje - funcionario.data_admissao).days
-            if dias_desde_admissao >= 7:
-                funcionario.tipo_vinculo = "FT - EFETIVADO"
-                funcionario.save()
+    # A sessão guarda apenas o id do usuário; o elenco vem do cache compartilhado do processo
+    cache_do_elenco().sincronizar()
+    promover_programa_anjo()
+    podar_alteracoes()
 
 # Tela de login
 def login_screen():
@@ -218,15 +1557,32 @@ def adicionar_prestador():
         except Exception as e:
             st.error(f"Erro ao cadastrar prestador: {str(e)}")
 
+RESULTADOS_POR_PAGINA = 10
+
 def gerenciar_prestadores():
     st.header("Gerenciar Pessoas Já Cadastradas")
     nome_busca = st.text_input("Digite o nome do prestador para buscar", key="busca_prestador")
+    if st.session_state.get("ultima_busca") != nome_busca:
+        # Busca nova sempre começa na primeira página
+        st.session_state["ultima_busca"] = nome_busca
+        st.session_state["pagina_busca"] = 1
     if nome_busca:
         try:
-            prestadores = Funcionario.buscar_por_nome(nome_busca)
-            if not prestadores:
+            # Só a página atual vira formulário; uma busca curta não cria centenas de widgets
+            pagina = st.session_state.get("pagina_busca", 1)
+            prestadores, total = Funcionario.paginar_busca(nome_busca, RESULTADOS_POR_PAGINA, (pagina - 1) * RESULTADOS_POR_PAGINA)
+            if not total:
                 st.warning("Nenhum prestador encontrado com esse nome.")
                 return
+            paginas = (total - 1) // RESULTADOS_POR_PAGINA + 1
+            if pagina > paginas:
+                # Exclusões encolheram o resultado e a página guardada não existe mais
+                pagina = st.session_state["pagina_busca"] = 1
+                prestadores, total = Funcionario.paginar_busca(nome_busca, RESULTADOS_POR_PAGINA)
+            if paginas > 1:
+                st.number_input("Página", min_value=1, max_value=paginas, step=1, key="pagina_busca")
+            offset = (pagina - 1) * RESULTADOS_POR_PAGINA
+            st.caption(f"Mostrando {offset + 1}–{offset + len(prestadores)} de {total} resultado(s)")
             for prestador in prestadores:
                 with st.container(border=True):
                     st.subheader(f"Prestador: {prestador.nome}")
@@ -250,27 +1606,61 @@ def gerenciar_prestadores():
                         
                         btn_cols = st.columns(3)
                         if btn_cols[0].form_submit_button("Salvar Agendamento", use_container_width=True):
-                            prestador.turno = turno
-                            prestador.local = local
-                            prestador.save()
+                            editado = prestador.copia()
+                            editado.turno = turno
+                            editado.local = local
+                            editado.save()
                             st.success(f"Agendamento atualizado para {prestador.nome}!")
                             time.sleep(1); st.rerun()
                         if btn_cols[1].form_submit_button("Registrar Folga", use_container_width=True):
                             if data_inicio_folga > data_fim_folga:
                                 st.error("A data de início da folga deve ser anterior ou igual à data de fim.")
                             else:
-                                prestador.folgas.append((data_inicio_folga, data_fim_folga))
-                                prestador.save()
+                                editado = prestador.copia()
+                                editado.folgas.append((data_inicio_folga, data_fim_folga))
+                                editado.save()
                                 st.success(f"Folga registrada para {prestador.nome}!"); time.sleep(1); st.rerun()
                         if btn_cols[2].form_submit_button("🗑️ Excluir Prestador", type="primary", use_container_width=True):
-                            conn = get_db_connection(); c = conn.cursor()
-                            c.execute('DELETE FROM folgas WHERE id_funcionario = ?', (prestador.id,)); c.execute('DELETE FROM funcionarios WHERE id = ?', (prestador.id,)); conn.commit(); conn.close()
-                            if prestador.id in Funcionario._funcionarios: del Funcionario._funcionarios[prestador.id]
-                            if "funcionarios_state" in st.session_state and prestador.id in st.session_state["funcionarios_state"]: del st.session_state["funcionarios_state"][prestador.id]
+                            prestador.delete()
                             st.success(f"Prestador {prestador.nome} excluído!"); time.sleep(1); st.rerun()
         except Exception as e:
             st.error(f"Erro ao buscar prestadores: {str(e)}")
 
+# Cadastro em massa: um CSV de prestadores e/ou um de folgas, gravados em uma única transação
+def importar_exportar():
+    st.header("Importar e Exportar Prestadores")
+    st.caption(f"Prestadores: {', '.join(COLUNAS_PRESTADORES)} — Folgas: {', '.join(COLUNAS_FOLGAS)}. "
+               "Datas em AAAA-MM-DD ou DD/MM/AAAA; turno e local podem ficar vazios (quem já está cadastrado mantém os atuais).")
+    with st.form("form_importar_csv"):
+        arquivo_prestadores = st.file_uploader("Prestadores (CSV)", type="csv", key="csv_prestadores")
+        arquivo_folgas = st.file_uploader("Folgas (CSV)", type="csv", key="csv_folgas")
+        importar = st.form_submit_button("Importar")
+    if importar:
+        if not arquivo_prestadores and not arquivo_folgas:
+            st.warning("Selecione ao menos um arquivo.")
+        else:
+            try:
+                with st.spinner("Importando..."):
+                    resultado = importar_csv(
+                        io.TextIOWrapper(arquivo_prestadores, encoding="utf-8-sig", newline="") if arquivo_prestadores else None,
+                        io.TextIOWrapper(arquivo_folgas, encoding="utf-8-sig", newline="") if arquivo_folgas else None)
+                st.success(f"{resultado.prestadores} prestador(es) e {resultado.folgas} folga(s) importados.")
+                if resultado.folgas_repetidas:
+                    st.info(f"{resultado.folgas_repetidas} folga(s) já estavam registradas e foram ignoradas.")
+                if resultado.erros:
+                    st.warning(f"{len(resultado.erros)} linha(s) com erro não foram importadas:")
+                    st.dataframe([{"arquivo": arquivo, "linha": linha, "erro": mensagem} for arquivo, linha, mensagem in resultado.erros],
+                                 hide_index=True)
+            except Exception as e:
+                st.error(f"Erro ao importar: {str(e)}")
+    st.subheader("Exportar")
+    # O arquivo só é gerado quando pedido, não a cada rerun da página
+    cols = st.columns(2)
+    if cols[0].button("Gerar CSV de prestadores"):
+        cols[0].download_button("⬇️ prestadores.csv", "".join(exportar_prestadores_csv()), "prestadores.csv", "text/csv")
+    if cols[1].button("Gerar CSV de folgas"):
+        cols[1].download_button("⬇️ folgas.csv", "".join(exportar_folgas_csv()), "folgas.csv", "text/csv")
+
 # =============================================================================
 # FUNÇÃO DE VISUALIZAÇÃO GERAL (TOTALMENTE REFEITA)
 # =============================================================================
@@ -324,49 +1714,6 @@ def visualizacao_geral():
     </style>
     """, unsafe_allow_html=True)
 
-    # --- FUNÇÃO AUXILIAR PARA RENDERIZAR O CALENDÁRIO ---
-    def render_calendar_html(ano, mes, start_day, end_day):
-        calendar.setfirstweekday(calendar.SUNDAY) # Começa a semana no Domingo
-        dias_da_semana = ["Domingo", "Segunda", "Terça", "Quarta", "Quinta", "Sexta", "Sábado"]
-        cal = calendar.monthcalendar(ano, mes)
-        last_day_parity = calendar.monthrange(ano, mes)[1] % 2 == 0
-        
-        # Cabeçalho dos dias da semana
-        header_html = "".join([f"<th style='border: 1px solid #ccc; padding: 4px; text-align: center; font-size: 8pt; width: 14%;'>{d}</th>" for d in dias_da_semana])
-        html = f"<table style='width: 100%; border-collapse: collapse;'><thead><tr>{header_html}</tr></thead><tbody>"
-
-        for semana in cal:
-            html += "<tr>"
-            for dia in semana:
-                if dia == 0 or not (start_day <= dia <= end_day):
-                    html += "<td style='border: 1px solid #ccc; height: 100px;'></td>"
-                    continue
-
-                prestadores = Funcionario.buscar_por_dia(dia, mes, ano, last_day_parity)
-                cell_content = f"<div style='font-weight: bold; text-align: center;'>{dia}</div>"
-                
-                prestadores_dia = sorted([p for p in prestadores if "Dia" in p.turno and not any(date(ano, mes, dia) >= di and date(ano, mes, dia) <= df for di, df in p.folgas)], key=lambda x: x.nome)
-                prestadores_noite = sorted([p for p in prestadores if "Noite" in p.turno and not any(date(ano, mes, dia) >= di and date(ano, mes, dia) <= df for di, df in p.folgas)], key=lambda x: x.nome)
-                folgas = sorted([p for p in prestadores if any(date(ano, mes, dia) >= di and date(ano, mes, dia) <= df for di, df in p.folgas)], key=lambda x: x.nome)
-
-                if prestadores_dia:
-                    cell_content += "<div style='font-size: 7pt; text-align: center; font-weight: bold; background-color: #e0e0e0;'>7h-19h</div>"
-                    for p in prestadores_dia:
-                        cell_content += f"<div style='font-size: 6pt; background-color: #d1e7ff; padding: 1px; margin-top: 1px; border-radius: 2px;'>{p.nome.split()[0]} - {p.local}</div>"
-                if prestadores_noite:
-                    cell_content += "<div style='font-size: 7pt; text-align: center; font-weight: bold; background-color: #e0e0e0;'>19h-7h</div>"
-                    for p in prestadores_noite:
-                        cell_content += f"<div style='font-size: 6pt; background-color: #ffd1dc; padding: 1px; margin-top: 1px; border-radius: 2px;'>{p.nome.split()[0]} - {p.local}</div>"
-                if folgas:
-                    cell_content += "<div style='font-size: 7pt; text-align: center; font-weight: bold; background-color: #e0e0e0;'>Folga</div>"
-                    for p in folgas:
-                        cell_content += f"<div style='font-size: 6pt; background-color: #f0f0f0; padding: 1px; margin-top: 1px; border-radius: 2px;'>{p.nome.split()[0]}</div>"
-
-                html += f"<td style='border: 1px solid #ccc; vertical-align: top; padding: 2px;'>{cell_content}</td>"
-            html += "</tr>"
-        html += "</tbody></table>"
-        return html
-
     hoje = datetime.today()
     ano, mes = hoje.year, hoje.month
     ultimo_dia_mes = calendar.monthrange(ano, mes)[1]
@@ -381,7 +1728,7 @@ def visualizacao_geral():
             streamlit_js_eval(js_expressions="printDiv('quinzena1')")
         
         # Cria o conteúdo da primeira quinzena dentro de uma div com ID específico
-        html_q1 = render_calendar_html(ano, mes, 1, 15)
+        html_q1 = calendario_html(ano, mes, 1, 15)
         st.markdown(f"<div id='quinzena1' class='printable-content'>{html_q1}</div>", unsafe_allow_html=True)
         
     with tab2:
@@ -391,24 +1738,78 @@ def visualizacao_geral():
             streamlit_js_eval(js_expressions="printDiv('quinzena2')")
             
         # Cria o conteúdo da segunda quinzena dentro de uma div com ID específico
-        html_q2 = render_calendar_html(ano, mes, 16, ultimo_dia_mes)
+        html_q2 = calendario_html(ano, mes, 16, ultimo_dia_mes)
         st.markdown(f"<div id='quinzena2' class='printable-content'>{html_q2}</div>", unsafe_allow_html=True)
 
+# Painel de cobertura: pessoas por plantão e dias abaixo do mínimo em cada local
+def cobertura_escala():
+    st.header("Cobertura dos Plantões")
+    cobertura = cache_do_elenco().cobertura()
+    hoje = date.today()
+    periodo = st.date_input("Período", value=(hoje, min(hoje + timedelta(days=90), cobertura.fim)),
+                            min_value=cobertura.inicio, max_value=cobertura.fim, format="DD/MM/YYYY", key="periodo_cobertura")
+    if len(periodo) != 2:
+        st.info("Selecione a data final do período.")
+        return
+    inicio, fim = periodo
+    dias = (fim - inicio).days + 1
+    st.caption("Mínimo por plantão: " + "; ".join(f"{local}: {m[DIA]} (7h-19h), {m[NOITE]} (19h-7h)" for local, m in MINIMO_POR_PLANTAO.items()))
+    for aba, local in zip(st.tabs(LOCAIS), LOCAIS):
+        with aba:
+            cols = st.columns(4)
+            cols[0].metric("Média 7h-19h", f"{cobertura.total(local, DIA, inicio, fim) / dias:.1f}")
+            cols[1].metric("Média 19h-7h", f"{cobertura.total(local, NOITE, inicio, fim) / dias:.1f}")
+            cols[2].metric("Folgas (pessoas-dia)", cobertura.total(local, FOLGA, inicio, fim))
+            cols[3].metric("Dias abaixo do mínimo", cobertura.dias_abaixo_do_minimo(local, DIA, inicio, fim)
+                           + cobertura.dias_abaixo_do_minimo(local, NOITE, inicio, fim))
+            st.line_chart({"data": [inicio + timedelta(days=i) for i in range(dias)],
+                           **{plantao: cobertura.por_dia(local, codigo, inicio, fim)
+                              for plantao, codigo in zip(_PLANTOES, (DIA, NOITE, FOLGA))}}, x="data")
+            alertas = cobertura.alertas(local, inicio, fim)
+            if alertas:
+                st.warning(f"{len(alertas)} plantão(ões) abaixo do mínimo:")
+                st.dataframe([{"data": data.strftime('%d/%m/%Y'), "dia": _DIAS_DA_SEMANA[(data.weekday() + 1) % 7],
+                               "plantão": _PLANTOES[plantao - 1], "pessoas": pessoas, "mínimo": minimo}
+                              for data, plantao, pessoas, minimo in alertas], hide_index=True)
+            else:
+                st.success("Todos os plantões do período atingem o mínimo.")
+
 # Menu principal
 def main_menu():
     st.sidebar.title(f"Bem-vindo(a), {st.session_state['usuario']['nome']}")
-    pagina = st.sidebar.radio("Selecione uma opção:", ["Adicionar novo prestador", "Gerenciar prestadores", "Visualização geral"])
+    pagina = st.sidebar.radio("Selecione uma opção:", ["Adicionar novo prestador", "Gerenciar prestadores", "Importar / Exportar", "Visualização geral", "Cobertura"])
     if st.session_state["usuario"]["gerente"]:
         if st.sidebar.button("Novo Registro (Supervisor)"):
             st.session_state["pagina"] = "adicionar_supervisor"
             st.rerun()
+        painel_desempenho()
     st.session_state["pagina"] = pagina
     if pagina == "Adicionar novo prestador":
         adicionar_prestador()
     elif pagina == "Gerenciar prestadores":
         gerenciar_prestadores()
+    elif pagina == "Importar / Exportar":
+        importar_exportar()
     elif pagina == "Visualização geral":
         visualizacao_geral()
+    elif pagina == "Cobertura":
+        cobertura_escala()
+
+# Painel do gerente com o detalhamento dos últimos reruns desta sessão
+def painel_desempenho():
+    with st.sidebar.expander("Desempenho"):
+        stats = cache_do_elenco().estatisticas()
+        st.caption(f"Cache do elenco: {stats['acertos']} acertos / {stats['falhas']} falhas (versão {stats['versao']})")
+        st.checkbox(f"Gravar reruns em {ARQUIVO_LOG_DESEMPENHO}", key="log_desempenho")
+        reruns = list(st.session_state.get("desempenho", ()))
+        if not reruns:
+            st.caption("Nenhum rerun medido ainda.")
+            return
+        st.dataframe([{"início": r["inicio"][11:], "página": r["pagina"], "total (ms)": r["total_ms"], "SQL": r["sql_execucoes"], **r["fases"]}
+                      for r in reversed(reruns)], hide_index=True)
+        ultimo = reruns[-1]
+        st.caption("Consultas do último rerun")
+        st.dataframe(sorted(({"consulta": forma, **c} for forma, c in ultimo["sql"].items()), key=lambda c: -c["ms"]), hide_index=True)
 
 # Botão de logout
 def logout_button():
@@ -419,14 +1820,16 @@ def logout_button():
 # Código principal
 def main():
     st.set_page_config(page_title="Sistema Cotolengo", layout="wide")
-    init_session()
-    if not st.session_state.get("autenticado"):
-        login_screen()
-    elif st.session_state.get("pagina") == "adicionar_supervisor" and st.session_state.get("usuario", {}).get("gerente"):
-        adicionar_supervisor()
-    else:
-        logout_button()
-        main_menu()
+    with medir_rerun():
+        init_session()
+        if not st.session_state.get("autenticado"):
+            login_screen()
+        elif st.session_state.get("pagina") == "adicionar_supervisor" and st.session_state.get("usuario", {}).get("gerente"):
+            adicionar_supervisor()
+        else:
+            logout_button()
+            with medir_fase("conteúdo da página"):
+                main_menu()
 
 if __name__ == "__main__":
     main()